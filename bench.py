@@ -0,0 +1,512 @@
+from templatize import Templatize, DiskTemplateCache, FragmentCache, FunctionCache, Loader, Profiler, memoize
+from lib.template import Template
+import time, gc, os, sys, json, platform, argparse, tempfile, tracemalloc
+
+
+def timed(func, number=1):
+    gc.collect()
+    start = time.perf_counter()
+    for i in range(number):
+        func()
+    return (time.perf_counter() - start) / number
+
+
+# Escape-heavy generated template of roughly the given size in bytes.
+def make_parse_template(size):
+    chunk = r"<p>Order !{{id}} for {{name.first::capitalize}} {{! note }}{{#items}}{{.sku}} {{/items}}</p>"
+    return chunk * max(1, size // len(chunk))
+
+
+def bench_parse():
+    print("------Parse throughput------")
+    results = []
+    for mb in (1, 2, 4, 8):
+        template = make_parse_template(mb*1024*1024)
+        seconds = timed(lambda : Template(template))
+        results.append((mb, seconds))
+        print("{0:>3} MB: {1:.3f} s ({2:.2f} MB/s)".format(mb, seconds, mb/seconds))
+    # linear scaling means time per MB stays roughly flat as size grows
+    print("scaling (time per MB, largest vs smallest): {0:.2f}x".format(
+        (results[-1][1]/results[-1][0]) / (results[0][1]/results[0][0])
+    ))
+
+
+def bench_render_many():
+    print("------Batch rendering------")
+    template = r"<p>Dear {{name.first::capitalize}},</p>{{#items}}<li>{{.sku}} - {{.price::$.2f}}</li>{{/items}}<p>{{total::$.2f}}</p>"
+    bindings = [
+        {
+            'name': {'first': "customer {0}".format(i)}, 
+            'items': [{'sku': "A{0}".format(i), 'price': i}, {'sku': "B{0}".format(i), 'price': i/2}], 
+            'total': i*1.5
+        }
+        for i in range(20000)
+    ]
+    interface = Templatize.make(template)
+    looped = timed(lambda : [interface.render(b) for b in bindings])
+    batched = timed(lambda : list(interface.render_many(bindings)))
+    print("render() loop: {0:.2f} us/item".format(looped*1e6/len(bindings)))
+    print("render_many(): {0:.2f} us/item ({1:.2f}x)".format(batched*1e6/len(bindings), looped/batched))
+    workers = min(4, os.cpu_count() or 1)
+    if workers > 1:
+        parallel = timed(lambda : list(interface.render_many(bindings, workers=workers, batch_size=500)))
+        print("render_many(workers={0}): {1:.2f} us/item ({2:.2f}x)".format(
+            workers, parallel*1e6/len(bindings), looped/parallel
+        ))
+
+
+def bench_nesting():
+    print("------Deep section nesting------")
+    template = r"{{#l1}}{{#.l2}}{{#.l3}}{{#.l4}}{{site.name}} {{site.meta.owner}} {{.v}} {{currency}}|{{/.l4}}{{/.l3}}" \
+               r"{{/.l2}}{{/l1}}"
+    bindings = {
+        'site': {'name': "site", 'meta': {'owner': "owner"}}, 
+        'currency': "$", 
+        'l1': [{'l2': [{'l3': [{'l4': [{'v': i} for i in range(5)]} for j in range(3)]} for k in range(3)]} for m in range(3)]
+    }
+    interface = Templatize.make(template)
+    seconds = timed(lambda : interface.render(bindings), 20)
+    print("4-deep sections, 135 items: {0:.2f} ms/render".format(seconds*1e3))
+
+
+def bench_memory():
+    print("------Parsed template memory------")
+    template = r"<h1>{{title::upper}}</h1>{{#sections}}<h2>{{.name::capitalize}}</h2>{{#.rows}}<tr><td>{{.sku}}</td>" \
+               r"<td>{{.price::$.2f}}</td><td>{{.qty}}</td><td>{{&.tags}}</td></tr>{{/.rows}}{{/sections}}" \
+               r"{{>footer}}{{#user->greeting}}{{.}}{{/user}}<p>{{total::$.2f;}}</p>" * 20
+    count = 200
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    templates = [Template(template) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("{0} bytes per parsed template ({1} chars of source)".format((after - before) // count, len(template)))
+
+
+def bench_repeating_memory():
+    print("------Repeating section peak memory------")
+    template = r"{{#rows}}<tr><td>{{.name}}</td><td>{{.price::$.2f}}</td><td>{{site}}</td></tr>{{/rows}}"
+    interface = Templatize.make(template)
+    for scoped in (False, True):
+        for count in (10000, 100000):
+            bindings = {'site': "site", 'rows': [{'name': "row", 'price': i} for i in range(count)]}
+            gc.collect()
+            tracemalloc.start()
+            for chunk in interface.render_iter(bindings, {"scoped_iterations": scoped}):
+                pass
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("scoped_iterations={0}, {1:>6} rows: {2:.1f} MB peak".format(scoped, count, peak/1024/1024))
+
+
+def bench_engines():
+    print("------Rendering engines------")
+    templates = {
+        'flat': r"<p>Dear {{name.first::capitalize}},</p><p>{{total::$.2f}}</p>{{#vip}}<b>VIP</b>{{/vip}}",
+        'repeating': r"{{#items}}<li>{{.sku}} - {{.price::$.2f}} ({{currency}})</li>{{/items}}",
+        'nested': r"{{#groups}}<h2>{{.name}}</h2>{{#.items}}<li>{{.sku}} - {{site.name}}</li>{{/.items}}{{/groups}}"
+    }
+    bindings = {
+        'name': {'first': "customer"}, 
+        'total': 1.5, 
+        'vip': True, 
+        'currency': "USD", 
+        'site': {'name': "shop"}, 
+        'items': [{'sku': "A{0}".format(i), 'price': i} for i in range(50)], 
+        'groups': [{'name': "group {0}".format(i), 'items': [{'sku': "B{0}".format(j)} for j in range(10)]} for i in range(5)]
+    }
+    for name, template in templates.items():
+        times = {}
+        for engine in ("two_pass", "single_pass"):
+            interface = Templatize.make(template, {"engine": engine})
+            times[engine] = timed(lambda : interface.render(bindings), 500)
+        print("{0:<10} two_pass: {1:.1f} us, single_pass: {2:.1f} us ({3:.2f}x)".format(
+            name, times["two_pass"]*1e6, times["single_pass"]*1e6, times["two_pass"]/times["single_pass"]
+        ))
+
+
+def bench_escaping():
+    print("------HTML escaping------")
+    template = r"{{#rows}}<tr><td>{{.name}}</td><td>{{.note}}</td><td>{{.price::$.2f}}</td></tr>{{/rows}}"
+    bindings = {'rows': [{'name': "item {0}".format(i), 'note': "Fish & Chips" if i % 10 == 0 else "plain", 'price': i} for i in range(200)]}
+    interface = Templatize.make(template)
+    plain = timed(lambda : interface.render(bindings, {"escape_all": False}), 50)
+    escaped = timed(lambda : interface.render(bindings, {"escape_all": True}), 50)
+    print("escape_all=False: {0:.2f} ms, escape_all=True: {1:.2f} ms ({2:+.1f}%)".format(
+        plain*1e3, escaped*1e3, (escaped/plain - 1)*100
+    ))
+
+
+def bench_fragments():
+    print("------Fragment cache------")
+    template = (
+        r"{{#nav}}<li><a href='{{.url}}'>{{.title::capitalize}}</a></li>{{/nav}}"
+        r"<h1>Hello {{user.name}}</h1>"
+        r"{{#footer}}<p>{{.text}} {{site.name}}</p>{{/footer}}"
+    )
+    bindings = {
+        'nav': [{'url': "/page/{0}".format(i), 'title': "page {0}".format(i)} for i in range(100)], 
+        'footer': [{'text': "link {0}".format(i)} for i in range(50)], 
+        'site': {'name': "shop"}, 
+        'user': {'name': "Bob"}
+    }
+    uncached = Templatize.make(template)
+    fragments = FragmentCache(["nav", "footer"])
+    cached = Templatize.make(template, {"fragment_cache": fragments})
+    plain = timed(lambda : uncached.render(bindings), 100)
+    hits = timed(lambda : cached.render(bindings), 100)
+    print("uncached: {0:.1f} us, cached: {1:.1f} us ({2:.1f}x), {3}".format(
+        plain*1e6, hits*1e6, plain/hits, fragments.stats()
+    ))
+
+
+def bench_session():
+    print("------Incremental render------")
+    template = "".join(
+        r"<div>{{{{#panel{0}}}}}<h2>{{{{.title}}}}</h2>{{{{#.rows}}}}<td>{{{{.name}}}} {{{{.value::.2f}}}}</td>{{{{/.rows}}}}{{{{/panel{0}}}}}</div>".format(i)
+        for i in range(20)
+    )
+    bindings = dict(
+        ("panel{0}".format(i), {'title': "panel {0}".format(i), 'rows': [{'name': "row {0}".format(j), 'value': j} for j in range(20)]})
+        for i in range(20)
+    )
+    interface = Templatize.make(template)
+    session = interface.session(bindings)
+    def change():
+        bindings['panel3']['rows'][0]['value'] += 1
+    full = timed(lambda : (change(), interface.render(bindings)), 20)
+    by_path = timed(lambda : (change(), session.update(changed=["panel3.rows"])), 20)
+    by_diff = timed(lambda : (change(), session.update()), 20)
+    print("full render: {0:.2f} ms, update(changed): {1:.2f} ms ({2:.1f}x), update(): {3:.2f} ms ({4:.1f}x)".format(
+        full*1e3, by_path*1e3, full/by_path, by_diff*1e3, full/by_diff
+    ))
+
+
+def bench_memoized_functions():
+    print("------Memoized functions------")
+    def convert(self, root):
+        # stand-in for an expensive lookup (e.g. currency conversion table)
+        rate = sum(i*i for i in range(2000)) / 2664667000.0
+        return "{0} {1:.2f}".format(root["currency"], self["price"]*rate)
+    template = r"{{#items}}<li>{{.name}} {{.label}}</li>{{/items}}"
+    def bindings(label):
+        return {'currency': "EUR", 'items': [{'name': "item", 'price': i % 20, 'label': label} for i in range(200)]}
+    plain = Templatize.make(template)
+    functions = FunctionCache()
+    cached = Templatize.make(template, {"function_cache": functions})
+    uncached_time = timed(lambda : plain.render(bindings(convert)), 20)
+    memoized = bindings(memoize(".price", "currency")(convert))
+    cached_time = timed(lambda : cached.render(memoized), 20)
+    print("uncached: {0:.2f} ms, memoized: {1:.2f} ms ({2:.1f}x), {3}".format(
+        uncached_time*1e3, cached_time*1e3, uncached_time/cached_time, functions.stats()
+    ))
+
+
+def bench_lazy_bindings():
+    print("------Lazy bindings------")
+    # each load call stands in for one round trip to a data source
+    def fetch(count):
+        time.sleep(0.0002)
+        fetch.calls += 1
+    class Row(Loader):
+        def __init__(self, index):
+            self.index = index
+        @classmethod
+        def load_many(cls, rows, paths):
+            fetch(len(rows))
+            return [{'name': "row", 'price': row.index % 20} for row in rows]
+    class Root(Loader):
+        def load(self, paths):
+            fetch(1)
+            return {'title': "Rows", 'rows': [Row(i) for i in range(200)]}
+    # loads each row on its own (the default load_many()), one round trip per row
+    class PerRow(Loader):
+        def __init__(self, values):
+            self.values = values
+        def load(self, paths):
+            fetch(1)
+            return dict((key, self.values[key]) for key in paths if key in self.values)
+    def per_row():
+        return PerRow({'title': "Rows", 'rows': [PerRow({'name': "row", 'price': i % 20}) for i in range(200)]})
+    interface = Templatize.make(r"<h1>{{title}}</h1>{{#rows}}<li>{{.name}} {{.price}}</li>{{/rows}}")
+    fetch.calls = 0
+    per_row_time = timed(lambda : interface.render(per_row()), 5)
+    per_row_calls, fetch.calls = fetch.calls / 5, 0
+    batched_time = timed(lambda : interface.render(Root()), 5)
+    print("per-row: {0:.2f} ms ({1:.0f} loads), batched: {2:.2f} ms ({3:.0f} loads) ({4:.1f}x)".format(
+        per_row_time*1e3, per_row_calls, batched_time*1e3, fetch.calls / 5, per_row_time/batched_time
+    ))
+
+
+def read_file(path):
+    with open(path, encoding="utf-8") as fp:
+        return fp.read()
+
+
+def bench_mapped_templates():
+    print("------Memory-mapped templates------")
+    # report-style template, mostly static markup with a few tags per block
+    block = r"<table class='report'><tr><th>Region</th><th>Total</th></tr>" + "<tr><td>static row</td></tr>"*40 + \
+            r"<tr><td>{{region}}</td><td>{{total::$.2f}}</td></tr></table>"
+    size = 32*1024*1024
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".html", delete=False) as fp:
+        fp.write(block * (size // len(block)))
+    bindings = {'region': "north", 'total': 1234.5}
+    try:
+        for label, load in (
+            ("str", lambda : Templatize.make(read_file(fp.name))), 
+            ("from_file", lambda : Templatize.make_file(fp.name))
+        ):
+            gc.collect()
+            tracemalloc.start()
+            start = time.perf_counter()
+            interface = load()
+            parsed = time.perf_counter() - start
+            held = tracemalloc.get_traced_memory()[0]
+            with open(os.devnull, "w") as out:
+                interface.render_to(bindings, out)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            del interface
+            print("{0:<10} {1:.0f} MB file: parse {2:.2f} s, {3:.1f} MB held after parse, {4:.1f} MB peak streaming to file".format(
+                label, size/1024/1024, parsed, held/1024/1024, peak/1024/1024
+            ))
+    finally:
+        os.remove(fp.name)
+
+
+def bench_disk_cache():
+    print("------Disk template cache------")
+    # stand-in for a worker booting with a set of page templates sharing partials
+    body = r"<h2>{{.name::capitalize}}</h2>{{#.rows}}<tr><td>{{.sku}}</td><td>{{.price::$.2f}}</td><td>{{&.tags}}</td>" \
+           r"</tr>{{/.rows}}<p>{{total::$.2f}} {{site.name}}</p>{{#user.admin}}{{>admin}}{{/user.admin}}"
+    templates = [r"{{>header}}<h1>Page " + str(i) + r"</h1>{{#sections}}" + body*20 + r"{{/sections}}{{>footer}}" for i in range(50)]
+    partials = {
+        'header': r"<header>{{site.name}} {{#user}}{{.name}}{{/user}}</header>" * 10, 
+        'footer': r"<footer>{{site.name}} &copy; {{year}}</footer>" * 10, 
+        'admin':  r"<a href='/admin/{{.id}}'>{{.name}}</a>" * 10
+    }
+    def boot(options=None):
+        return [Templatize.make(template, dict(options if options else {}, partials=partials)) for template in templates]
+    with tempfile.TemporaryDirectory() as directory:
+        disk_cache = DiskTemplateCache(directory)
+        parse_time = timed(boot, 3)
+        boot({"disk_cache": disk_cache})  # first boot writes entries
+        load_time = timed(lambda : boot({"disk_cache": disk_cache}), 3)
+        print("{0} templates + {1} partials: parse {2:.1f} ms, load from disk cache {3:.1f} ms ({4:.1f}x), {5}".format(
+            len(templates), len(partials), parse_time*1e3, load_time*1e3, parse_time/load_time, disk_cache.stats()
+        ))
+
+
+def bench_profiler():
+    print("------Profiler------")
+    template = r"<h1>{{title}}</h1>{{#items}}<li>{{.sku}} - {{.price::$.2f}} ({{currency}})</li>{{/items}}"
+    bindings = {'title': "Items", 'currency': "USD", 'items': [{'sku': "A{0}".format(i), 'price': i} for i in range(50)]}
+    interface = Templatize.make(template)
+    profiler = Profiler()
+    plain_time = timed(lambda : interface.render(bindings), 500)
+    profiled_time = timed(lambda : interface.render(bindings, {"profiler": profiler}), 500)
+    print("disabled: {0:.1f} us, profiling: {1:.1f} us ({2:.2f}x overhead)".format(
+        plain_time*1e6, profiled_time*1e6, profiled_time/plain_time
+    ))
+    print(profiler.report())
+
+
+# Benchmark suite. Each workload sets up its data once, given a scale (1 for full size), and returns the operation to
+# time. Runs record ops/sec (best of repeats) and peak memory of one operation, which may be saved as a baseline and
+# compared against on later runs (see main()).
+
+def suite_parse(scale):
+    template = make_parse_template(int(4*1024*1024*scale))
+    return lambda : Template(template)
+
+
+def suite_deep_nesting(scale):
+    depth = 8
+    template = r"{{site.name}}"
+    for level in reversed(range(depth)):
+        template = r"{{{{#{0}l{1}}}}}{2} {{{{.v}}}}|{{{{/{0}l{1}}}}}".format("." if level else "", level, template)
+    def level(i):
+        return {'v': i} if i == depth else {'v': i, "l{0}".format(i): [level(i+1), level(i+1)]}
+    bindings = dict(level(1), l0=[level(1) for i in range(max(1, int(10*scale)))], site={'name': "site"})
+    interface = Templatize.make(template)
+    return lambda : interface.render(bindings)
+
+
+# Repeating section of count items. If streamed, rendered in chunks with scoped iterations, as for output too large
+# to hold in memory all at once.
+def suite_repeating(count, stream=False):
+    def setup(scale):
+        template = r"<tr><td>{{.sku}}</td><td>{{.price::$.2f}}</td><td>{{currency}}</td></tr>"
+        interface = Templatize.make(r"{{#rows}}" + template + r"{{/rows}}")
+        rows = [{'sku': "A{0}".format(i), 'price': i} for i in range(100)]
+        bindings = {'currency': "USD", 'rows': [rows[i % 100] for i in range(max(1, int(count*scale)))]}
+        if stream:
+            return lambda : sum(len(chunk) for chunk in interface.render_iter(bindings, {"scoped_iterations": True}))
+        return lambda : interface.render(bindings)
+    return setup
+
+
+def suite_partial_fanout(scale):
+    # each partial includes the next level of partials, ten wide, three deep, for every item
+    partials = {'leaf': r"<i>{{.name}}</i>"}
+    for level in (2, 1):
+        partials["level{0}".format(level)] = "".join(
+            r"{{{{>{0}}}}}".format("level{0}".format(level+1) if level < 2 else "leaf") for i in range(10)
+        )
+    interface = Templatize.make(r"{{#items}}{{>level1}}{{/items}}", {'partials': partials})
+    bindings = {'items': [{'name': "item {0}".format(i)} for i in range(max(1, int(10*scale)))]}
+    return lambda : interface.render(bindings)
+
+
+def suite_function_bindings(scale):
+    template = r"{{#items}}<li>{{.label}} {{.total::$.2f}} {{.flag}}</li>{{/items}}<p>{{summary}}</p>"
+    label = lambda self, root : self["name"].upper()
+    total = lambda self, root : self["price"] * root["tax"]
+    flag  = lambda self, root : "sale" if self["price"] % 3 == 0 else ""
+    bindings = {
+        'tax': 1.1, 
+        'summary': lambda self, root : "{0} items".format(len(root["items"])), 
+        'items': [
+            {'name': "item {0}".format(i), 'price': i, 'label': label, 'total': total, 'flag': flag} 
+            for i in range(max(1, int(2000*scale)))
+        ]
+    }
+    interface = Templatize.make(template)
+    return lambda : interface.render(bindings)
+
+
+def suite_escape_all(scale):
+    template = r"{{#rows}}<tr><td>{{.name}}</td><td>{{.note}}</td><td>{{.price::$.2f}}</td></tr>{{/rows}}"
+    bindings = {'rows': [
+        {'name': "item <{0}>".format(i), 'note': "Fish & Chips \"large\"" if i % 2 else "plain", 'price': i} 
+        for i in range(max(1, int(5000*scale)))
+    ]}
+    interface = Templatize.make(template, {"escape_all": True})
+    return lambda : interface.render(bindings)
+
+
+# workloads by name, with the number of timed repeats of each
+SUITE = {
+    'parse_4mb':          (suite_parse, 3), 
+    'deep_nesting':       (suite_deep_nesting, 5), 
+    'repeating_10k':      (suite_repeating(10000), 5), 
+    'repeating_100k':     (suite_repeating(100000), 3), 
+    'repeating_1m':       (suite_repeating(1000000, stream=True), 1), 
+    'partial_fanout':     (suite_partial_fanout, 3), 
+    'function_bindings':  (suite_function_bindings, 5), 
+    'escape_all':         (suite_escape_all, 5)
+}
+
+
+def run_suite(names=None, scale=1.0):
+    results = {}
+    for name in (names if names else SUITE):
+        setup, repeat = SUITE[name]
+        operation = setup(scale)
+        # warm up, then time enough operations per repeat that short ones are not lost to timer noise
+        number = max(1, int(0.2 / timed(operation)))
+        seconds = min(timed(operation, number) for i in range(repeat))
+        gc.collect()
+        tracemalloc.start()
+        operation()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = {'ops_per_sec': 1.0/seconds, 'peak_memory': peak}
+        print("{0:<18} {1:>12.2f} ops/sec {2:>10.1f} MB peak".format(name, 1.0/seconds, peak/1024/1024))
+    return results
+
+
+# Workloads slower (in ops/sec) or using more peak memory than the baseline, by more than the threshold fraction.
+def regressions(results, baseline, threshold):
+    found = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        if result['ops_per_sec'] < before['ops_per_sec']*(1 - threshold):
+            found.append("{0}: {1:.2f} ops/sec vs {2:.2f} baseline ({3:+.1f}%)".format(
+                name, result['ops_per_sec'], before['ops_per_sec'], (result['ops_per_sec']/before['ops_per_sec'] - 1)*100
+            ))
+        if result['peak_memory'] > before['peak_memory']*(1 + threshold):
+            found.append("{0}: {1} bytes peak vs {2} baseline ({3:+.1f}%)".format(
+                name, result['peak_memory'], before['peak_memory'], (result['peak_memory']/before['peak_memory'] - 1)*100
+            ))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Templatize benchmarks. Without a command, runs the benchmark report.")
+    commands = parser.add_subparsers(dest="command")
+    suite = commands.add_parser("suite", help="run benchmark suite, comparing against (or saving) a baseline")
+    suite.add_argument("names", nargs="*", metavar="workload", help="workloads to run (default all): " + ", ".join(SUITE))
+    # kept next to this script (and ignored by git) as timings are specific to the machine
+    suite.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json"), 
+                       help="baseline JSON file (default %(default)s)")
+    suite.add_argument("--save", action="store_true", help="save results as the new baseline instead of comparing")
+    suite.add_argument("--threshold", type=float, default=0.2, 
+                       help="allowed fraction slower or more peak memory than baseline (default %(default)s)")
+    suite.add_argument("--scale", type=float, default=1.0, help="workload size multiplier (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.command != "suite":
+        run_report()
+        return 0
+
+    unknown = [name for name in args.names if name not in SUITE]
+    if unknown:
+        parser.error("unknown workload(s): {0}".format(", ".join(unknown)))
+    results = run_suite(args.names, args.scale)
+    # baselines are only comparable at the same scale and on the same interpreter
+    environment = {'scale': args.scale, 'python': platform.python_version(), 'machine': platform.machine()}
+
+    if args.save:
+        saved = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as fp:
+                saved = json.load(fp)
+            if saved.get('environment') != environment:
+                saved = {}
+        saved['environment'] = environment
+        saved.setdefault('results', {}).update(results)
+        with open(args.baseline, "w") as fp:
+            json.dump(saved, fp, indent=2, sort_keys=True)
+        print("saved baseline to {0}".format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("no baseline at {0}, run with --save to create one".format(args.baseline))
+        return 0
+    with open(args.baseline) as fp:
+        baseline = json.load(fp)
+    if baseline.get('environment') != environment:
+        print("warning: baseline recorded with {0}, running with {1}".format(baseline.get('environment'), environment))
+    found = regressions(results, baseline.get('results', {}), args.threshold)
+    for line in found:
+        print("REGRESSION " + line)
+    if found:
+        return 1
+    print("no regressions past {0:.0%} threshold".format(args.threshold))
+    return 0
+
+
+def run_report():
+    bench_parse()
+    bench_render_many()
+    bench_engines()
+    bench_escaping()
+    bench_fragments()
+    bench_session()
+    bench_memoized_functions()
+    bench_lazy_bindings()
+    bench_profiler()
+    bench_nesting()
+    bench_memory()
+    bench_repeating_memory()
+    bench_mapped_templates()
+    bench_disk_cache()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
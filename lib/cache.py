@@ -0,0 +1,480 @@
+from collections import OrderedDict
+from lib.nodes import PartialNode, SectionNode
+from lib.misc import TYPES, type_of
+from lib.template import Template, is_static, all_static, node_dependencies, fallback_paths
+import os, threading, tempfile, time, json, hashlib
+
+
+DEFAULT = {
+    "size":          128, 
+    "fragment_size": 1024, 
+    "function_size": 4096
+}
+
+
+# Bounded, thread-safe LRU cache of parsed templates. Keyed on template text plus the options that affect parsing
+# (delimiters and compile), so equal template strings share a single Template instance.
+class TemplateCache:
+
+    def __init__(self, size=None):
+        self._lock      = threading.Lock()
+        self._entries   = OrderedDict()
+        self._size      = DEFAULT["size"]
+        self.hits       = 0
+        self.misses     = 0
+        self.evictions  = 0
+        self.resize(size if size is not None else DEFAULT["size"])
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(template, options=None):
+        delimiters = None
+        compiled   = False
+        if options:
+            if "delimiters" in options and options["delimiters"]:
+                delimiters = tuple(options["delimiters"])
+            compiled = bool(options["compile"]) if "compile" in options else False
+        return (template, delimiters, compiled)
+
+    # Get the template from the cache or, if missing, create it with the supplied factory function and store it.
+    def get(self, template, options=None, factory=None):
+        key = TemplateCache.key(template, options)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+        # parse outside of lock, if two threads parse the same template at once the last one stored wins
+        created = factory(template, options)
+        with self._lock:
+            self._entries[key] = created
+            self._entries.move_to_end(key)
+            self._trim()
+        return created
+
+    # Set max number of cached templates. Size of zero disables caching.
+    def resize(self, size):
+        if size is None or int(size) < 0:
+            raise Exception("Invalid cache size: {0}".format(size))
+        with self._lock:
+            self._size = int(size)
+            self._trim()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size":      self._size,
+                "count":     len(self._entries),
+                "hits":      self.hits,
+                "misses":    self.misses,
+                "evictions": self.evictions
+            }
+
+    def _trim(self):
+        while len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+# Cache of parsed templates on disk, shared across processes (e.g. workers all loading the same templates on startup).
+# Each entry is a file in the directory, named by a hash of the template content and the options that affect parsing,
+# holding the serialized template (see Template.dumps()), which loads much faster than parsing. Entries written in
+# another serialized format or by another version of Python, or otherwise unreadable, are stale, and are parsed and
+# written again.
+# Entries are written to a temporary file and renamed into place, so processes never read partly written entries.
+class DiskTemplateCache:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock     = threading.Lock()
+        self.hits      = 0
+        self.misses    = 0
+        self.rebuilds  = 0
+        os.makedirs(directory, exist_ok=True)
+
+    # Locks can't be pickled, so recreated on load (e.g. in worker processes), with counters reset.
+    def __getstate__(self):
+        return {"directory": self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(state["directory"])
+
+    @staticmethod
+    def key(template, options=None):
+        delimiters, compiled = TemplateCache.key("", options)[1:]
+        digest = hashlib.sha256(json.dumps([delimiters, compiled]).encode("utf-8"))
+        digest.update(template.encode("utf-8"))
+        return digest.hexdigest()
+
+    # Get the template from the cache or, if missing or stale, create it with the supplied factory function (by
+    # default parsing it) and store it.
+    def get(self, template, options=None, factory=None):
+        path = os.path.join(self.directory, DiskTemplateCache.key(template, options) + ".tpl")
+        stale = False
+        try:
+            with open(path, "rb") as fp:
+                loaded = Template.loads(fp.read())
+            with self._lock:
+                self.hits += 1
+            return loaded
+        except FileNotFoundError:
+            pass
+        except Exception:
+            stale = True
+        created = factory(template, options) if factory else Template(template, options)
+        with self._lock:
+            if stale:
+                self.rebuilds += 1
+            else:
+                self.misses += 1
+        self._write(path, created)
+        return created
+
+    # Cache is only an optimization, so templates are still rendered if entries can't be serialized or written (e.g.
+    # read-only).
+    def _write(self, path, template):
+        try:
+            data = template.dumps()
+        except Exception:
+            return
+        try:
+            handle, temp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        except OSError:
+            return
+        try:
+            with os.fdopen(handle, "wb") as fp:
+                fp.write(data)
+            os.replace(temp, path)
+        except OSError:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def _entries(self):
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".tpl")]
+
+    # Delete all entries and reset counters.
+    def clear(self):
+        with self._lock:
+            for path in self._entries():
+                os.remove(path)
+            self.hits = self.misses = self.rebuilds = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "count":    len(self._entries()),
+                "hits":     self.hits,
+                "misses":   self.misses,
+                "rebuilds": self.rebuilds
+            }
+
+
+# Bounded, thread-safe LRU cache (with optional time-to-live in seconds) of rendered section output. Only sections
+# whose keys are listed in sections are cached, and only where they always resolve the same data wherever rendered
+# (i.e. the section and everything within is resolved from the root or in-context to the section). Entries are keyed
+# on the section, the render options affecting output, the content of partials within, and a fingerprint of the
+# binding values at every key path the section refers to, so changed data is simply a cache miss. Only plain data
+# (as JSON) can be fingerprinted, so sections depending on functions or other objects are rendered without caching,
+# unless given a function in keys (by section key), called with the root bindings to return a hashable key for the
+# section's data instead.
+class FragmentCache:
+
+    def __init__(self, sections, size=None, ttl=None, keys=None):
+        self.sections      = set(sections)
+        self.ttl           = ttl
+        self.keys          = dict(keys) if keys else {}
+        self._lock         = threading.Lock()
+        self._entries      = OrderedDict()
+        self._size         = DEFAULT["fragment_size"]
+        self.hits          = 0
+        self.misses        = 0
+        self.bypasses      = 0
+        self.evictions     = 0
+        self.expirations   = 0
+        self.invalidations = 0
+        self.resize(size if size is not None else DEFAULT["fragment_size"])
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Locks can't be pickled, so cache is sent empty (e.g. to worker processes) and recreated on load.
+    def __getstate__(self):
+        return {"sections": self.sections, "size": self._size, "ttl": self.ttl, "keys": self.keys}
+
+    def __setstate__(self, state):
+        self.__init__(state["sections"], state["size"], state["ttl"], state["keys"])
+
+    # Whether section node in template is cached. Dependencies are found once per template and section.
+    def caches(self, template, node):
+        if node.key not in self.sections:
+            return False
+        return _fragment_info(template, node) is not None
+
+    # Get rendered section output from the cache or, if missing or expired, render with supplied function and store.
+    # Sections whose data can't be fingerprinted (and without a key function) are rendered without caching.
+    def get(self, renderer, node, render):
+        paths, partials = _fragment_info(renderer.template, node)
+        if node.key in self.keys:
+            fingerprint = ("key", self.keys[node.key](renderer.root.data))
+        else:
+            fingerprint = _fingerprint(renderer, paths)
+            if fingerprint is None:
+                with self._lock:
+                    self.bypasses += 1
+                return render()
+        key = (
+            node, 
+            type(renderer), 
+            renderer.escape_all, 
+            renderer.eval_zero_as_true, 
+            fingerprint, 
+            tuple(renderer.partials.get(name).digest() if name in renderer.partials else None for name in partials)
+        )
+        with self._lock:
+            if key in self._entries:
+                rendered, expires, _ = self._entries[key]
+                if expires is None or expires > time.monotonic():
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return rendered
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+        rendered = render()
+        with self._lock:
+            self._entries[key] = (rendered, time.monotonic() + self.ttl if self.ttl else None, paths)
+            self._entries.move_to_end(key)
+            self._trim()
+        return rendered
+
+    # Drop all cached sections referring to key path, to anything under it, or to anything containing it.
+    def invalidate(self, path):
+        prefix = path + "."
+        with self._lock:
+            for key in [
+                key for key, (_, _, paths) in self._entries.items()
+                if any(p == path or p.startswith(prefix) or path.startswith(p + ".") for p in paths)
+            ]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    # Set max number of cached fragments. Size of zero disables caching.
+    def resize(self, size):
+        if size is None or int(size) < 0:
+            raise Exception("Invalid cache size: {0}".format(size))
+        with self._lock:
+            self._size = int(size)
+            self._trim()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.bypasses = self.evictions = self.expirations = self.invalidations = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size":          self._size,
+                "count":         len(self._entries),
+                "hits":          self.hits,
+                "misses":        self.misses,
+                "hit_rate":      self.hits / lookups if lookups else 0.0,
+                "bypasses":      self.bypasses,
+                "evictions":     self.evictions,
+                "expirations":   self.expirations,
+                "invalidations": self.invalidations
+            }
+
+    def _trim(self):
+        while len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+# Bounded, thread-safe LRU cache (with optional time-to-live in seconds) of results of memoized function bindings
+# (see misc.memoize()). Keyed on the function and the values of its declared inputs, so results are shared across
+# renders, across repeating section items, and across interfaces using the same cache. Inputs must be hashable or
+# plain data (as JSON), otherwise the function is called without caching. Exceptions are not cached.
+class FunctionCache:
+
+    def __init__(self, size=None, ttl=None):
+        self.ttl         = ttl
+        self._lock       = threading.Lock()
+        self._entries    = OrderedDict()
+        self._size       = DEFAULT["function_size"]
+        self.hits        = 0
+        self.misses      = 0
+        self.bypasses    = 0
+        self.evictions   = 0
+        self.expirations = 0
+        self.resize(size if size is not None else DEFAULT["function_size"])
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Locks can't be pickled, so cache is sent empty (e.g. to worker processes) and recreated on load.
+    def __getstate__(self):
+        return {"size": self._size, "ttl": self.ttl}
+
+    def __setstate__(self, state):
+        self.__init__(state["size"], state["ttl"])
+
+    # Call memoized function binding with the data it is called with and the root bindings, or get cached result.
+    def call(self, memoized, context, root):
+        values = _input_values(memoized.inputs, context, root)
+        # types included as equal values of different types (e.g. 1 and True) may not give the same result
+        key = (memoized.func, values, tuple(type(value) for value in values))
+        try:
+            hash(key)
+        except TypeError:
+            serialized = _serialize(values)
+            if serialized is None:
+                with self._lock:
+                    self.bypasses += 1
+                return memoized.func(context, root)
+            key = (memoized.func, serialized, key[2])
+        with self._lock:
+            if key in self._entries:
+                result, expires = self._entries[key]
+                if expires is None or expires > time.monotonic():
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return result
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+        result = memoized.func(context, root)
+        with self._lock:
+            self._entries[key] = (result, time.monotonic() + self.ttl if self.ttl else None)
+            self._entries.move_to_end(key)
+            self._trim()
+        return result
+
+    # Set max number of cached results. Size of zero disables caching.
+    def resize(self, size):
+        if size is None or int(size) < 0:
+            raise Exception("Invalid cache size: {0}".format(size))
+        with self._lock:
+            self._size = int(size)
+            self._trim()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.bypasses = self.evictions = self.expirations = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size":        self._size,
+                "count":       len(self._entries),
+                "hits":        self.hits,
+                "misses":      self.misses,
+                "hit_rate":    self.hits / lookups if lookups else 0.0,
+                "bypasses":    self.bypasses,
+                "evictions":   self.evictions,
+                "expirations": self.expirations
+            }
+
+    def _trim(self):
+        while len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+# Values of declared inputs, by key path from the root bindings, or from the context if starting with the in-context
+# directive (with just the directive being the context itself).
+def _input_values(inputs, context, root):
+    values = []
+    for path in inputs:
+        value = root
+        if path.startswith("."):
+            value = context
+            path = path[1:]
+        if path:
+            value = _lookup(value, path)
+        values.append(value)
+    return tuple(values)
+
+
+def _lookup(value, path):
+    for key in path.split("."):
+        if type_of(value) != TYPES.OBJECT:
+            return None
+        value = value[key] if key in value else None
+    return value
+
+
+# Values serialized as JSON, or None if not plain data (e.g. functions or other objects, whose repr may be reused by
+# other objects, so can't identify them).
+def _serialize(values):
+    try:
+        return json.dumps(values, sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+
+
+# Key paths (reduced to those not under another) and partial names a cacheable section depends on, or None if section
+# can't be cached. Stored on the template, by section.
+def _fragment_info(template, node):
+    fragments = getattr(template, "fragments", None)
+    if fragments is None:
+        fragments = template.fragments = {}
+    if node not in fragments:
+        info = None
+        # partials from the root may refer to anything, so sections with any are not cached
+        if is_static(node, False) and all_static(node) and not _has_root_partial(node):
+            found = node_dependencies(node)
+            paths = found["values"] | found["sections"] | found["functions"] | fallback_paths(node)
+            info = (
+                tuple(sorted(p for p in paths if not any(p.startswith(q + ".") for q in paths))), 
+                tuple(sorted(found["partials"]))
+            )
+        fragments[node] = info
+    return fragments[node]
+
+
+def _has_root_partial(container):
+    for node in container.inner:
+        if isinstance(node, PartialNode) and not node.incontext:
+            return True
+        if isinstance(node, SectionNode) and _has_root_partial(node):
+            return True
+    return False
+
+
+# Fingerprint of binding values at key paths, or None if any is not plain data. Values are taken at each path, or the
+# nearest value above it that is not a dictionary (e.g. a list or function).
+def _fingerprint(renderer, paths):
+    values = []
+    for path in paths:
+        value = renderer.root.data
+        for key in path.split("."):
+            if type_of(value) != TYPES.OBJECT:
+                break
+            value = value[key] if key in value else None
+        values.append(value)
+    serialized = _serialize(values)
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest() if serialized is not None else None
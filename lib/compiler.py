@@ -0,0 +1,81 @@
+from lib.nodes import TextNode, PartialNode, SectionNode
+from lib.directives import DIRECTIVES
+
+
+# Precomputed dispatch for the outside-in render pass. Each container in the node tree (the root and every section)
+# is lowered into a chain of specialized step functions, with node type, directive, and context checks resolved once
+# here, so rendering only calls the steps in order. This is all that is lowered: the inside-out pass walks the tree of
+# processed nodes built by each render (e.g. copies of repeating sections filled with their deferred content), which
+# doesn't exist ahead of time, so is still interpreted. The gain is only on the per-node checks, so modest (roughly
+# 5-10% on templates mostly of tags outside repeating sections, none within them).
+class Program:
+
+    def __init__(self, root):
+        self.steps = {}
+        self._compile(root)
+
+    def _compile(self, container):
+        steps = []
+        for node in container.inner:
+            # comments are dropped entirely
+            if node.directive == DIRECTIVES.COMMENT:
+                continue
+            if isinstance(node, TextNode):
+                steps.append(_text_step(node))
+            elif isinstance(node, PartialNode):
+                steps.append(_partial_step(node))
+            else:
+                if isinstance(node, SectionNode):
+                    self._compile(node)
+                steps.append(_tag_step(node))
+        self.steps[container] = steps
+
+    def run(self, renderer, container, domain, processed, unresolved):
+        for step in self.steps[container]:
+            step(renderer, domain, processed, unresolved)
+        return processed
+
+
+def _text_step(node):
+    def step(renderer, domain, processed, unresolved):
+        processed.inner.append(node)
+    return step
+
+
+def _partial_step(node):
+    def step(renderer, domain, processed, unresolved):
+        processed.inner.append(renderer._partial(node, domain))
+    return step
+
+
+def _tag_step(node):
+    # mirrors the checks in Renderer._render_outside_in(), but with everything not dependent on data precomputed
+    for_section = isinstance(node, SectionNode)
+    check_node  = not for_section and node.directive != DIRECTIVES.LIST
+    has_func    = bool(node.func)
+    deferrable  = bool(node.incontext or (has_func and node.func.incontext))
+    key         = node.key
+    fkey        = node.func.key if has_func else None
+
+    def step(renderer, domain, processed, unresolved):
+        if for_section and renderer.fragments is not None and renderer.fragments.caches(renderer.template, node):
+            processed.inner.append(renderer._fragment(node))
+            return
+        # in-context nodes within an unresolved context are deferred
+        if deferrable and domain.isrepeating:
+            processed.inner.append(node)
+            return
+        if unresolved and (check_node or has_func):
+            for u in unresolved:
+                if (check_node and u.incontext(key)) or (has_func and u.incontext(fkey)):
+                    processed.inner.append(node)
+                    return
+        context = renderer._process_context(node, domain)
+        if context is None:
+            processed.inner.append(node)
+        elif for_section:
+            renderer._section(node, context, processed, unresolved)
+        else:
+            processed.inner.append(renderer._render_value(node, context.value))
+
+    return step
@@ -13,13 +13,15 @@ class DynamicDomain:
     # Dynamic data domain acts as if in the same location as this domain (with same key and parent), but with
     # dynamic data that is different. Note that if search up to parent and back down, however, it cannot be 
     # re-found with same key. It is technically stored as a dynamic child of this domain.
-    def create(self, dkey, with_data, index=0):
+    # If not kept, the data domain is not stored, so it is only referenced for as long as the caller holds it.
+    def create(self, dkey, with_data, index=0, keep=True):
         dykey = "<{0}:{1}>".format(index if index else 0, dkey)
         if dykey in self.children:
             return self.children[dykey]
         context = Domain(with_data, self.domain.fullkey, self.domain.parent)
         context.cache = {}  # disconnect cache for dynamic contexts
-        self.children[dykey] = context
+        if keep:
+            self.children[dykey] = context
         return context
 
     # Get dynamic length.
@@ -32,9 +34,9 @@ class DynamicDomain:
 
     # Get dynamic data domain by index. Used for repeating sections to dynamically load the domain of an 
     # array item. If not an array-type, simply loads the current data.
-    def get(self, index, on_func_error=None):
+    def get(self, index, on_func_error=None, keep=True):
         data = self.domain.data[index] if self.domain.isrepeating else self.domain._eval(on_func_error)
-        return self.create("", data, index)
+        return self.create("", data, index, keep)
 
 
 class Domain:
@@ -52,6 +54,8 @@ class Domain:
         self.children      = {".": self}
         self.isrepeating   = False
         self.dynamic       = DynamicDomain(self)
+        self.memo          = None  # function cache, only set on the root domain
+        self.profiler      = None  # profiler, only set on the root domain
         # function store reference to function, data is f() output but resolved whenever first called
         if self.type == TYPES.FUNCTION:
             self.function = self.data
@@ -65,7 +69,12 @@ class Domain:
 
     def _eval(self, on_func_error=None):
         if self.function and not self.data:
-            self.data = evalf(self.function, self.parent.data, self.root.data, on_func_error)
+            if self.root.profiler is None:
+                self.data = evalf(self.function, self.parent.data, self.root.data, on_func_error, self.root.memo)
+            else:
+                self.data = self.root.profiler.function(self.fullkey, lambda : evalf(
+                    self.function, self.parent.data, self.root.data, on_func_error, self.root.memo
+                ))
             self.type = type_of(self.data)
             if self.type == TYPES.ARRAY:
                 self.isrepeating = True
@@ -96,7 +105,8 @@ class Domain:
         # get context or create if not yet existing
         if key in self.children:
             return self.children[key]
-        if key not in self.data:
+        # plain values (e.g. the data of an exclusive section over false) have no children
+        if self.type == TYPES.VALUE or key not in self.data:
             return None
         subcontext = Domain(self.data[key], fullkey, self)
         self.cache[fullkey] = self.children[key] = subcontext
@@ -148,5 +158,11 @@ class Domain:
         # special case for naked context tags
         if not node.key and node.incontext:
             return self
+        # statically resolved to root scope (no bubbling needed)
+        if node.rooted:
+            root = self.root
+            if node.key in root.cache:
+                return root.cache[node.key]
+            return root._search(node.key, list(node.keysplit), on_func_error)
         # try cache with full keys (note in-context nodes skip bubble)
-        return self._search(node.key, node.keysplit[:], on_func_error, (not node.incontext), True)
+        return self._search(node.key, list(node.keysplit), on_func_error, (not node.incontext), True)
@@ -0,0 +1,105 @@
+import collections.abc
+
+
+# Lazy bindings. Subclass and implement load() to fetch data only when rendered, given all the key paths the template
+# may touch within this scope in one call. Loaders are treated as dictionaries, and may be used as the root bindings
+# or returned as values (or lists of values) by another loader, in which case they are given the key paths under
+# their own. Sibling loaders in the same list are loaded together with load_many(), which may be overridden to fetch
+# all of them in one batch (e.g. one query for all rows).
+#
+# Keys not loaded up front (e.g. not known from the template, or read by function bindings) are loaded individually
+# when first accessed. Key paths given include "_display" under each section (see sections), which may be returned or
+# left out as any other.
+class Loader(collections.abc.Mapping):
+
+    _loaded  = None
+    _paths   = None
+    _batch   = None
+    _missing = None
+
+    # Load data for key paths relative to this loader, returning dictionary of values by top-level key (the first
+    # part of each path). Values may be data, functions, or other loaders. Keys not returned are treated as missing.
+    def load(self, paths):
+        raise NotImplementedError("Loader subclasses must implement load()")
+
+    # Load many sibling loaders (all of this class) for the same key paths, returning list of results of load().
+    @classmethod
+    def load_many(cls, loaders, paths):
+        return [loader.load(paths) for loader in loaders]
+
+    # Set key paths to load, loading now if not yet loaded. Returns self.
+    def prefetch(self, paths):
+        self._paths = sorted(set(paths))
+        self._ensure()
+        return self
+
+    def _ensure(self):
+        if self._loaded is not None:
+            return
+        paths = self._paths if self._paths is not None else []
+        batch = [loader for loader in self._batch if loader._loaded is None] if self._batch else [self]
+        if self not in batch:
+            batch.append(self)
+        # group siblings by class, so each class loads its own in one call
+        grouped = collections.OrderedDict()
+        for loader in batch:
+            grouped.setdefault(type(loader), []).append(loader)
+        requested = set(path.split(".")[0] for path in paths)
+        values = []
+        for cls, loaders in grouped.items():
+            results = cls.load_many(loaders, paths) if paths else [None]*len(loaders)
+            for loader, loaded in zip(loaders, results):
+                loader._loaded = dict(loaded) if loaded else {}
+                loader._batch = None
+                # keys asked for but not returned are missing, not loaded again individually
+                loader._missing = requested - set(loader._loaded)
+                values.extend(loader._loaded.items())
+        _scope(values, paths)
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return self._loaded[key]
+
+    def __contains__(self, key):
+        self._ensure()
+        if key in self._loaded:
+            return True
+        if key in self._missing:
+            return False
+        loaded = self.load([key])
+        if loaded and key in loaded:
+            self._loaded[key] = loaded[key]
+            _scope([(key, loaded[key])], [])
+            return True
+        self._missing.add(key)
+        return False
+
+    def __iter__(self):
+        self._ensure()
+        return iter(self._loaded)
+
+    def __len__(self):
+        self._ensure()
+        return len(self._loaded)
+
+    def __repr__(self):
+        return "{0}({1!r})".format(type(self).__name__, self._loaded)
+
+
+# Give loaders within values (as key, value pairs) the key paths to load under their key, without loading yet. Loaders
+# under the same key (or items of lists under it) share a batch, so the first one accessed loads all of them.
+def _scope(values, paths):
+    batches = {}
+    for key, value in values:
+        if isinstance(value, Loader):
+            batches.setdefault(key, []).append(value)
+        elif isinstance(value, (list, tuple)):
+            batches.setdefault(key, []).extend(item for item in value if isinstance(item, Loader))
+    for key, batch in batches.items():
+        batch = [loader for loader in batch if loader._loaded is None and loader._batch is None]
+        scoped = [path[len(key)+1:] for path in paths if path.startswith(key + ".")]
+        for loader in batch:
+            if loader._paths is None:
+                loader._paths = scoped
+            loader._batch = batch
@@ -1,4 +1,4 @@
-import collections, collections.abc
+import collections, collections.abc, asyncio, inspect, functools, re
 
 
 _types = {
@@ -22,14 +22,50 @@ TYPES = _NT_types(*list(_types.values()))
 del _types, _NT_types
 
 
-def is_array(test):
-    return isinstance(test, collections.abc.Sequence) and not isinstance(test, str)
+# String already safe for output as markup, e.g. already escaped HTML or a rendered partial. Rendered as is, never
+# formatted or escaped again.
+class Markup(str):
+    __slots__ = ()
 
 
-def type_of(value):
-    if value is None:
-        return TYPES.NONE
-    if is_array(value):
+# Type classification is by concrete type, so cached per type to skip the (slow) abstract base class checks. Types
+# explicitly registered (see register_type()) apply to subclasses as well.
+_registered_types = {}
+_type_cache = {}
+
+
+def _reset_type_cache():
+    _type_cache.clear()
+    _type_cache.update({
+        type(None): TYPES.NONE, 
+        str:        TYPES.VALUE, 
+        Markup:     TYPES.VALUE, 
+        int:        TYPES.VALUE, 
+        float:      TYPES.VALUE, 
+        bool:       TYPES.VALUE, 
+        list:       TYPES.ARRAY, 
+        tuple:      TYPES.ARRAY, 
+        dict:       TYPES.DICTIONARY
+    })
+    _type_cache.update(_registered_types)
+
+_reset_type_cache()
+
+
+# Declare how values of a custom type (and its subclasses) are treated, as one of TYPES.VALUE, TYPES.ARRAY, 
+# TYPES.DICTIONARY, or TYPES.FUNCTION. Arrays must support len() and indexing, dictionaries `in` and key access.
+def register_type(cls, as_type):
+    if as_type not in (TYPES.VALUE, TYPES.ARRAY, TYPES.DICTIONARY, TYPES.FUNCTION):
+        raise Exception("Invalid type to register {0} as: {1}".format(cls, as_type))
+    _registered_types[cls] = as_type
+    _reset_type_cache()
+
+
+def _classify(value):
+    for base in type(value).__mro__:
+        if base in _registered_types:
+            return _registered_types[base]
+    if isinstance(value, collections.abc.Sequence) and not isinstance(value, str):
         return TYPES.ARRAY
     if isinstance(value, collections.abc.Mapping):
         return TYPES.DICTIONARY
@@ -38,7 +74,42 @@ def type_of(value):
     return TYPES.VALUE
 
 
-def evalf(func, context, root, handle_exception=None):
+def is_array(test):
+    return type_of(test) == TYPES.ARRAY
+
+
+def type_of(value):
+    try:
+        return _type_cache[type(value)]
+    except KeyError:
+        vtype = _type_cache[type(value)] = _classify(value)
+        return vtype
+
+
+# Function binding marked for memoization across renders (see memoize()). Called as is unless rendered with a
+# function cache (see lib.cache.FunctionCache), which then calls it only once per distinct set of declared inputs.
+class Memoized:
+
+    def __init__(self, func, inputs=None):
+        self.func   = func
+        self.inputs = tuple(inputs) if inputs else ()
+
+    def __call__(self, context, root):
+        return self.func(context, root)
+
+    def __repr__(self):
+        return "Memoized({0!r}, {1!r})".format(self.func, self.inputs)
+
+
+# Decorator marking function binding for memoization. Inputs are the key paths the result depends on, from the root
+# bindings, or with a leading in-context directive (e.g. ".price"), from the data the function is called with.
+def memoize(*inputs):
+    def decorator(func):
+        return Memoized(func, inputs)
+    return decorator
+
+
+def evalf(func, context, root, handle_exception=None, memo=None):
     if not context:
         context = {}
     try:
@@ -48,7 +119,10 @@ def evalf(func, context, root, handle_exception=None):
             i += 1
             if i >= OVERFLOW:
                 break
-            val = val(context, root)
+            if memo is not None and isinstance(val, Memoized):
+                val = memo.call(val, context, root)
+            else:
+                val = val(context, root)
         return val
     except Exception as e:
         if not handle_exception:
@@ -56,42 +130,160 @@ def evalf(func, context, root, handle_exception=None):
         return handle_exception(e)
 
 
-def format_value(value, format_op, escape_html=False):
+def is_async(value):
+    return inspect.iscoroutinefunction(value) or inspect.isawaitable(value)
+
+
+# Async version of evalf() that also awaits any awaitables in the chain of evaluation.
+async def evalf_async(func, context, root):
+    if not context:
+        context = {}
+    val = func
+    i = 0
+    while callable(val) or inspect.isawaitable(val):
+        i += 1
+        if i >= OVERFLOW:
+            break
+        val = await val if inspect.isawaitable(val) else val(context, root)
+    return val
+
+
+# Resolve async bindings (coroutine functions and awaitables) found along the given key paths (e.g. those a template
+# refers to) concurrently, descending into each item of lists along the way. Coroutine functions are called like any
+# function binding, with the object containing it and the root bindings. Anything async within resolved values is
+# resolved in turn, along the rest of the same paths. Bindings off every path are left as is, and data is copied down
+# any path with anything resolved, so the original bindings are not modified. Failures are given to handle_exception
+# with the key path and exception, whose return is used as the value, or raised if no handler.
+async def resolve_async(bindings, paths, handle_exception=None):
+    tree = {}
+    for path in paths:
+        branch = tree
+        for key in path.split("."):
+            branch = branch.setdefault(key, {})
+    return await _resolve_tree(bindings, tree, bindings, "", handle_exception)
+
+
+# Await all concurrently, raising the first exception (if any) only once all are done.
+async def _gather(awaitables):
+    results = await asyncio.gather(*awaitables, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def _resolve_tree(data, tree, root, prefix, handle_exception):
+    if not tree:
+        return data
+    if is_array(data):
+        items = await _gather([_resolve_tree(item, tree, root, prefix, handle_exception) for item in data])
+        return items if any(item is not original for item, original in zip(items, data)) else data
+    if type_of(data) != TYPES.OBJECT:
+        return data
+    keys = [key for key in tree if key in data]
+    values = await _gather([_resolve_key(data, key, tree[key], root, prefix + key, handle_exception) for key in keys])
+    copied = None
+    for key, value in zip(keys, values):
+        if value is not data[key]:
+            if copied is None:
+                copied = dict(data)
+            copied[key] = value
+    return copied if copied is not None else data
+
+
+async def _resolve_key(data, key, tree, root, path, handle_exception):
+    value = data[key]
+    if is_async(value):
+        try:
+            value = await evalf_async(value, data, root)
+        except Exception as e:
+            if not handle_exception:
+                raise e
+            return handle_exception(path, e)
+    return await _resolve_tree(value, tree, root, path + ".", handle_exception)
+
+
+# HTML escape special characters. Each replace is only done if the character is present, so values without any
+# (the most common case) are returned as is after a few fast scans.
+def escape_html(value):
+    if "&" in value:
+        value = value.replace("&", "&amp;")
+    if "<" in value:
+        value = value.replace("<", "&lt;")
+    if ">" in value:
+        value = value.replace(">", "&gt;")
+    if "\"" in value:
+        value = value.replace("\"", "&quot;")
+    if "'" in value:
+        value = value.replace("'", "&#039;")
+    return value
+
+
+# Format directives are compiled once into formatter functions, called with the value and whether to escape. All are
+# module-level functions (or partials of them) so parsed templates stay picklable.
+_formatters = {}
+_CAPITALIZE = re.compile(r"(?:^|(?<=\s))\S")
+
+
+def _format_plain(value, escape):
+    return escape_html(str(value)) if escape else str(value)
+
+
+def _format_raw(value, escape):
+    return str(value)
+
+
+def _format_encode(value, escape):
+    return escape_html(str(value))
+
+
+def _format_upper(value, escape):
+    return _format_plain(str(value).upper(), escape)
+
+
+def _format_lower(value, escape):
+    return _format_plain(str(value).lower(), escape)
+
+
+def _format_capitalize(value, escape):
+    return _format_plain(_CAPITALIZE.sub(lambda match : match.group().upper(), str(value)), escape)
+
+
+def _format_spec(prefix, spec, value, escape):
+    value = prefix + format(value, spec)
+    return escape_html(value) if escape else value
+
+
+def compile_format(format_op):
+    if format_op in _formatters:
+        return _formatters[format_op]
+    if format_op in ("raw", "html"):
+        formatter = _format_raw
+    elif format_op == "encode":
+        formatter = _format_encode
+    elif format_op in ("allcaps", "caps", "upper"):
+        formatter = _format_upper
+    elif format_op in ("lower",):
+        formatter = _format_lower
+    elif format_op == "capitalize":
+        formatter = _format_capitalize
+    elif not format_op:
+        formatter = _format_plain
+    else:
+        # spec only checked against the value it formats, as any type may define its own (e.g. dates)
+        prefix, spec = ("$", format_op[1:]) if format_op[0] == "$" else ("", format_op)
+        formatter = functools.partial(_format_spec, prefix, spec)
+    _formatters[format_op] = formatter
+    return formatter
+
+
+def apply_format(formatter, value, escape=False):
     if value is None:
         return ""
-    if format_op:
-        if format_op in ("raw", "html"):
-            value = str(value)
-            escape_html = False
-        elif format_op == "encode":
-            value = str(value)
-            escape_html = True
-        elif format_op in ("allcaps", "caps", "upper"):
-            value = str(value).upper()
-        elif format_op in ("lower",):
-            value = str(value).lower()
-        elif format_op == "capitalize":
-            value = str(value)
-            new_value = ""
-            for i, c in enumerate(value):
-                if not i or (not c.isspace() and value[i-1].isspace()):
-                    new_value += c.upper()
-                else:
-                    new_value += c
-            value = new_value
-        else:
-            if format_op[0] == "$":
-                format_op = "${0:"+format_op[1:]+"}"
-            else:
-                format_op = "{0:"+format_op+"}"
-            value = format_op.format(value)
-    else:
-        value = str(value)
-    if escape_html:
-        value = value.replace("&", "&amp;")   \
-                     .replace("<", "&lt;")    \
-                     .replace(">", "&gt;")    \
-                     .replace("\"", "&quot;") \
-                     .replace("'", "&#039;")
-    return value
-    
\ No newline at end of file
+    if isinstance(value, Markup):
+        return value
+    return formatter(value, escape)
+
+
+def format_value(value, format_op, escape=False):
+    return apply_format(compile_format(format_op), value, escape)
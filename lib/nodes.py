@@ -1,33 +1,67 @@
 from lib.directives import DIRECTIVES
+from lib.misc import compile_format
+import sys
 
 
+# Nodes use slots as many parsed templates may be kept in memory. Keys are interned and key paths stored as tuples.
 class Node:
+    __slots__ = ("key", "keysplit", "raw", "inner", "directive", "incontext", "func", "escape", "rooted")
+
     def __init__(self, key=None):
         self.key       = key if key else ""
-        self.keysplit  = []
+        self.keysplit  = ()
         self.raw       = None
         self.inner     = None
         self.directive = None
         self.incontext = None
         self.func      = None
         self.escape    = None
+        self.rooted    = False  # if search statically known to resolve from root (see template)
     def _finish(self):
-        self.keysplit = self.key.split(".")
+        self.key = sys.intern(self.key)
+        self.keysplit = tuple(sys.intern(k) for k in self.key.split("."))
 
 
 class RootNode(Node):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
         self.inner = []
 
 
 class TextNode(Node):
+    __slots__ = ("text",)
+
     def __init__(self, text):
         super().__init__()
         self.text = text
 
 
+# Text of a template parsed in place from a memory-mapped file (see Template.from_file()). Stored as (start, end) byte
+# offsets into the shared mapping instead of a copy, and decoded each time read.
+class MappedTextNode(TextNode):
+    __slots__ = ("source", "spans")
+
+    def __init__(self, source, spans):
+        Node.__init__(self)
+        self.source = source
+        self.spans  = tuple(spans)
+
+    @property
+    def text(self):
+        if len(self.spans) == 1:
+            return self.source[self.spans[0][0]:self.spans[0][1]].decode("utf-8")
+        return b"".join(self.source[start:end] for start, end in self.spans).decode("utf-8")
+
+    # mappings can't be pickled, so sent (e.g. to worker processes) as plain text
+    def __reduce__(self):
+        return (TextNode, (self.text,))
+
+
 class TagNode(Node):
+    __slots__ = ("format", "formatter")
+
     def __init__(self, raw, inner):
         super().__init__()
         self.raw       = raw
@@ -36,7 +70,8 @@ class TagNode(Node):
         self.incontext = False
         self.func      = None
         self.format    = ""
-        self.escape    = False
+        self.formatter = None
+        self.escape    = None
         # ignore empties (by marking as comment)
         if not len(self.inner):
             self.directive = DIRECTIVES.COMMENT
@@ -121,15 +156,22 @@ class TagNode(Node):
         if not len(self.key) and not self.incontext:
             # can't be empty except special case for pure context {{.}}
             raise Exception("Invalid tag: empty evaluation at {0}".format(self.raw))
+        # format directive compiled once, instead of for every value rendered
+        self.formatter = compile_format(self.format)
         # this fills keysplit
         self._finish()
+        # inner tag content only needed for parsing
+        self.inner = None
 
 
 class PassToFunctionNode(Node):
+    __slots__ = ()
+
     def __init__(self, key, context_node=None):
         if isinstance(key, PassToFunctionNode):
             super().__init__(key.key)
             self.incontext = key.incontext
+            self.rooted    = key.rooted
         else:
             super().__init__(key)
             self.incontext = False
@@ -143,6 +185,8 @@ class PassToFunctionNode(Node):
 
 
 class PartialNode(Node):
+    __slots__ = ()
+
     def __init__(self, tag):
         super().__init__()
         if tag.incontext:
@@ -155,7 +199,6 @@ class PartialNode(Node):
             raise Exception("Partial tag cannot be paired with pass-to-function directive at {0}".format(tag.raw))
         self.directive = DIRECTIVES.PARTIAL
         self.raw       = tag.raw
-        self.inner     = tag.inner
         self.key       = tag.key
         self.incontext = True  # partials default to in-context
         if self.key.endswith(DIRECTIVES.TO_SYMBOL[DIRECTIVES.ROOT_PARTIAL]):
@@ -167,11 +210,14 @@ class PartialNode(Node):
 
 
 class SectionNode(Node):
+    __slots__ = ("parent", "inclusive", "open", "list")
+
     def __init__(self, tag, parent):
         super().__init__(tag.key)
         self.raw       = tag.raw
         self.inner     = []
         self.incontext = tag.incontext
+        self.rooted    = tag.rooted
         self.parent    = parent
         if isinstance(tag, SectionNode):
             self.func      = PassToFunctionNode(tag.func) if tag.func else None
@@ -0,0 +1,52 @@
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import itertools
+
+
+DEFAULT = {
+    "batch_size": 100
+}
+
+# per-process worker state, set once by the pool initializer
+_worker = {}
+
+
+def _init_worker(template, partials, engine, options):
+    # import here to avoid circular import with lib.interface
+    from lib.interface import Interface
+    # template is this worker's own copy, so compiled once here instead of for each batch (two-pass engine only)
+    if engine in (None, "two_pass"):
+        template.compile()
+    _worker["interface"] = Interface(template, {"partials": partials, "engine": engine})
+    _worker["options"]   = options
+
+
+def _render_batch(batch):
+    return list(_worker["interface"].render_many(batch, _worker["options"]))
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+# Render many sets of bindings across a pool of worker processes. The parsed template and partials are sent to each
+# worker once, then bindings are streamed over in batches, with results yielded in the original order. Number of
+# batches in flight is bounded so large or lazy iterables are not consumed all at once. Bindings (including any
+# function bindings) must be picklable.
+def render_parallel(template, partials, bindings_list, options=None, workers=2, batch_size=None, engine=None):
+    batch_size = batch_size if batch_size else DEFAULT["batch_size"]
+    # partials are resolved here and sent with the template, so drop them from the per-render options
+    options = dict((key, value) for key, value in options.items() if key != "partials") if options else {}
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(template, partials, engine, options)) as pool:
+        pending = deque()
+        for batch in _batches(bindings_list, batch_size):
+            pending.append(pool.submit(_render_batch, batch))
+            if len(pending) >= workers*2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
@@ -0,0 +1,75 @@
+from lib.template import Template, parse
+from lib.cache import TemplateCache
+
+
+DEFAULT = {
+    "size": 256
+}
+
+
+# Registry of partial templates by name. Partials given as template strings are parsed once and kept in a bounded,
+# process-wide LRU cache by content (see TemplateCache), shared by all registries, so the same partial source is not
+# re-parsed, even under different names, in per-render overrides, or across interfaces (e.g. those created by each
+# Templatize.render() call). A registry may be attached to one interface or shared across many.
+class Partials:
+
+    # process-wide cache of parsed partial template strings
+    cache = TemplateCache(DEFAULT["size"])
+
+    def __init__(self, partials=None, options=None, parent=None):
+        self._templates = {}
+        self._parent    = parent
+        self._options   = options if options else (parent._options if parent else {})
+        if partials:
+            for name, partial in partials.items():
+                self.add(name, partial)
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __len__(self):
+        return len(self.names())
+
+    def names(self):
+        names = set(self._templates.keys())
+        if self._parent:
+            names |= self._parent.names()
+        return names
+
+    # Get parsed template for a template string from the shared cache, parsing only if not cached.
+    def compile(self, source):
+        return Partials.cache.get(source, self._options, _parse_partial)
+
+    def add(self, name, partial):
+        if isinstance(partial, str):
+            partial = self.compile(partial)
+        elif not isinstance(partial, Template):
+            raise Exception("Invalid partial: must be instance of Template or template string ('{0}' is {1})".format(name, type(partial)))
+        self._templates[name] = partial
+        return self
+
+    def remove(self, name):
+        if name in self._templates:
+            del self._templates[name]
+        return self
+
+    def get(self, name):
+        if name in self._templates:
+            return self._templates[name]
+        return self._parent.get(name) if self._parent else None
+
+    # Resolve per-render partials against this registry. A registry is used as is. A dictionary creates a child
+    # registry, sharing this one's parsed template store and falling back to it for any names not overridden.
+    def resolve(self, partials=None):
+        if not partials:
+            return self
+        if isinstance(partials, Partials):
+            return partials
+        return Partials(partials, parent=self)
+
+
+def _parse_partial(source, options):
+    try:
+        return parse(source, options)
+    except Exception as e:
+        raise Exception("Invalid partial template: {0}".format(e))
@@ -0,0 +1,282 @@
+from lib.nodes import TextNode, SectionNode, PartialNode
+import threading, time
+
+
+# Timings of one tag, section, partial, or function binding.
+class _Entry:
+    __slots__ = ("kind", "name", "position", "partial", "calls", "time", "bytes")
+
+    def __init__(self, kind, name, position=None, partial=None):
+        self.kind     = kind
+        self.name     = name
+        self.position = position
+        self.partial  = partial
+        self.calls    = 0
+        self.time     = 0.0
+        self.bytes    = 0
+
+    def as_dict(self):
+        return {
+            "kind":     self.kind,
+            "name":     self.name,
+            "position": self.position,
+            "partial":  self.partial,
+            "calls":    self.calls,
+            "time":     self.time,
+            "bytes":    self.bytes
+        }
+
+
+# Profiles renders it is given to (as the profiler option), recording wall time, call count, and output size per tag
+# and section (by raw tag and position in the template or partial it is in), per function binding (by key path), and
+# per partial (by name). Renderers are only instrumented when given a profiler, so rendering without one costs nothing
+# extra.
+#
+# Times include everything rendered within, so those of sections (and partials) include their content. Calls are the
+# number of times output was rendered for a tag or section, so do not count tags rendered once and reused (see
+# engines), or sections served from a fragment cache. Output of sections not repeating over a list is counted on the
+# tags within, as the default engine renders their content in place.
+class Profiler:
+
+    def __init__(self):
+        self.lock      = threading.Lock()
+        self.positions = {}
+        # depth of renders in progress per thread, so renders of partials within are not counted as renders
+        self.local     = threading.local()
+        self.clear()
+
+    # Timings are per process, so profilers are sent to worker processes empty (see render_many()).
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    # Empty all recorded timings.
+    def clear(self):
+        with self.lock:
+            self.entries   = {}
+            self.functions = {}
+            self.partials  = {}
+            self.renders   = 0
+            self.time      = 0.0
+
+    # Report of timings recorded so far.
+    def report(self):
+        with self.lock:
+            return ProfileReport(
+                [entry.as_dict() for entry in self.entries.values()],
+                [entry.as_dict() for entry in self.functions.values()],
+                [entry.as_dict() for entry in self.partials.values()],
+                self.renders,
+                self.time
+            )
+
+    # Replace renderer methods with timed versions, on that renderer instance only.
+    def instrument(self, renderer):
+        positions = self._positions(renderer.template)
+        # renderers of partials are created while rendering the partial tag (see render_partial())
+        within = getattr(self.local, "partial", None)
+        # nodes being timed by this renderer, so work nested under the same node is not counted twice
+        active = set()
+
+        def entry_of(node):
+            # copies of sections made while rendering keep the original opening tag
+            key = node.open if isinstance(node, SectionNode) else node
+            entry = self.entries.get(key)
+            if entry is None:
+                kind = "section" if isinstance(node, SectionNode) else "partial" if isinstance(node, PartialNode) else "tag"
+                entry = self.entries.setdefault(key, _Entry(kind, node.raw, positions.get(key), within))
+            return entry, key
+
+        def timed(node, func, *args, calls=0, output=False):
+            entry, key = entry_of(node)
+            if key in active:
+                return func(*args)
+            active.add(key)
+            start = time.perf_counter()
+            try:
+                result = func(*args)
+            finally:
+                elapsed = time.perf_counter() - start
+                active.discard(key)
+            with self.lock:
+                entry.calls += calls
+                entry.time  += elapsed
+                if output and result:
+                    entry.bytes += len(result.encode("utf-8"))
+            return result
+
+        def timed_iter(node, chunks, calls=1):
+            entry, key = entry_of(node)
+            if key in active:
+                yield from chunks
+                return
+            while True:
+                active.add(key)
+                start = time.perf_counter()
+                try:
+                    chunk = next(chunks, None)
+                finally:
+                    elapsed = time.perf_counter() - start
+                    active.discard(key)
+                with self.lock:
+                    entry.calls += calls
+                    entry.time  += elapsed
+                    if chunk:
+                        entry.bytes += len(chunk.encode("utf-8"))
+                calls = 0
+                if chunk is None:
+                    return
+                yield chunk
+
+        process_context = renderer._process_context
+        render_value    = renderer._render_value
+        partial         = renderer._partial
+        iter_section    = renderer._iter_section
+        section         = renderer._section
+        render          = renderer.render
+        iter_render     = renderer.iter
+
+        def render_all():
+            depth = self._enter()
+            start = time.perf_counter()
+            try:
+                return render()
+            finally:
+                elapsed = time.perf_counter() - start
+                self.local.depth = depth
+                if not depth:
+                    with self.lock:
+                        self.renders += 1
+                        self.time    += elapsed
+
+        def iter_all():
+            chunks = iter_render()
+            elapsed = 0.0
+            depth = getattr(self.local, "depth", 0)
+            try:
+                while True:
+                    self._enter()
+                    start = time.perf_counter()
+                    try:
+                        chunk = next(chunks, None)
+                    finally:
+                        elapsed += time.perf_counter() - start
+                        self.local.depth = depth
+                    if chunk is None:
+                        return
+                    yield chunk
+            finally:
+                if not depth:
+                    with self.lock:
+                        self.renders += 1
+                        self.time    += elapsed
+
+        def render_partial(node, context):
+            self.local.partial = node.key
+            start = time.perf_counter()
+            try:
+                rendered = timed(node, partial, node, context, calls=1, output=True)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.local.partial = within
+            with self.lock:
+                entry = self.partials.get(node.key)
+                if entry is None:
+                    entry = self.partials[node.key] = _Entry("partial", node.key)
+                entry.calls += 1
+                entry.time  += elapsed
+                entry.bytes += len(rendered.encode("utf-8"))
+            return rendered
+
+        renderer._process_context = lambda node, domain, dynamics=None : timed(node, process_context, node, domain, dynamics)
+        renderer._render_value    = lambda node, value : timed(node, render_value, node, value, calls=1, output=True)
+        renderer._partial         = render_partial
+        renderer._iter_section    = lambda node, domain, dynamics : timed_iter(node, iter_section(node, domain, dynamics))
+        # sections not repeating are rendered in place by the default engine, so counted here instead
+        renderer._section         = lambda node, context, processed, unresolved : timed(
+            node, section, node, context, processed, unresolved, calls=0 if context.isrepeating else 1
+        )
+        renderer.render           = render_all
+        renderer.iter             = iter_all
+        return renderer
+
+    # Mark a render as started on this thread, returning the depth of renders it is within.
+    def _enter(self):
+        depth = getattr(self.local, "depth", 0)
+        self.local.depth = depth + 1
+        return depth
+
+    # Time a function binding call, by key path.
+    def function(self, key, call):
+        start = time.perf_counter()
+        try:
+            return call()
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                entry = self.functions.get(key)
+                if entry is None:
+                    entry = self.functions[key] = _Entry("function", key)
+                entry.calls += 1
+                entry.time  += elapsed
+
+    # Position of each tag (or section opening tag) in the template, in order of appearance, found once per template.
+    def _positions(self, template):
+        positions = self.positions.get(template)
+        if positions is None:
+            positions = {}
+            _number(template.root, positions)
+            self.positions[template] = positions
+        return positions
+
+
+def _number(container, positions):
+    for node in container.inner:
+        if isinstance(node, TextNode):
+            continue
+        positions[node.open if isinstance(node, SectionNode) else node] = len(positions)
+        if isinstance(node, SectionNode):
+            _number(node, positions)
+
+
+# Timings recorded by a profiler. Tags (including sections and partial tags), functions, and partials are lists of
+# dictionaries of kind, name (raw tag, function key path, or partial name), position (tags only), partial (name of the
+# partial tags are in, if any), calls, time (in seconds), and bytes (of UTF-8 output, none for functions), sorted by
+# time, slowest first.
+class ProfileReport:
+
+    def __init__(self, tags, functions, partials, renders, time):
+        self.tags      = sorted(tags, key=lambda entry : -entry["time"])
+        self.functions = sorted(functions, key=lambda entry : -entry["time"])
+        self.partials  = sorted(partials, key=lambda entry : -entry["time"])
+        self.renders   = renders
+        self.time      = time
+
+    # Slowest entries of any kind.
+    def top(self, count=10):
+        return sorted(self.tags + self.functions + self.partials, key=lambda entry : -entry["time"])[:count]
+
+    def as_dict(self):
+        return {
+            "renders":   self.renders,
+            "time":      self.time,
+            "tags":      self.tags,
+            "functions": self.functions,
+            "partials":  self.partials
+        }
+
+    def __str__(self):
+        lines = ["{0} render(s) in {1:.3f} ms".format(self.renders, self.time*1e3)]
+        for entry in self.top(len(self.tags) + len(self.functions) + len(self.partials)):
+            lines.append("{0:>10.3f} ms {1:>7} calls {2:>9} bytes  {3:<8} {4}{5}{6}".format(
+                entry["time"]*1e3,
+                entry["calls"],
+                entry["bytes"],
+                entry["kind"],
+                entry["name"],
+                " @{0}".format(entry["position"]) if entry["position"] is not None else "", 
+                " in {0}".format(entry["partial"]) if entry["partial"] else ""
+            ))
+        return "\n".join(lines)
@@ -0,0 +1,443 @@
+from lib.nodes import RootNode, TextNode, PartialNode, SectionNode, Node
+from lib.misc import TYPES, Markup, type_of, evalf, apply_format, escape_html, is_array
+from lib.directives import DIRECTIVES
+from lib.domain import Domain
+from lib.loader import Loader
+import json
+
+
+class Result:
+
+    def __init__(self):
+        self.fullkey     = ""
+        self.isdynamic   = False
+        self.isrepeating = False
+        self.length      = 0
+        self.node        = None
+        self.value       = None
+        self.func        = None
+
+    def __len__(self):
+        return self.length
+
+    def get_domain(self):
+        if self.isrepeating:
+            if self.func:
+                return self.node.dynamic.create(self.func.fullkey, self.value)
+            return self.node
+        if not self.isdynamic:
+            return self.node
+        return self.node.dynamic.create(self.func.fullkey, self.value)
+
+
+# Per-render state and rendering. Created for each render call so that nothing changes on the interface while 
+# rendering, allowing a single interface to be used to render concurrently from many threads.
+class Renderer:
+
+    def __init__(self, interface, options=None):
+        if not options:
+            options = {}
+        self.interface = interface
+        self.template  = interface._template
+        self.root      = None
+        # render options override those set on the interface
+        self.error_on_func_failure = bool(options["error_on_func_failure"]) if "error_on_func_failure" in options \
+                                        else interface.error_on_func_failure
+        self.eval_zero_as_true     = bool(options["eval_zero_as_true"]) if "eval_zero_as_true" in options \
+                                        else interface.eval_zero_as_true
+        self.escape_all            = bool(options["escape_all"]) if "escape_all" in options \
+                                        else interface.escape_all
+        self.error_on_missing_tags = bool(options["error_on_missing_tags"]) if "error_on_missing_tags" in options \
+                                        else interface.error_on_missing_tags
+        self.scoped_iterations     = bool(options["scoped_iterations"]) if "scoped_iterations" in options \
+                                        else interface.scoped_iterations
+        self.fragments             = options["fragment_cache"] if "fragment_cache" in options \
+                                        else interface.fragment_cache
+        self.functions             = options["function_cache"] if "function_cache" in options \
+                                        else interface.function_cache
+        self.profiler              = options["profiler"] if "profiler" in options \
+                                        else interface.profiler
+        # snapshot options
+        self.options = {
+            "error_on_func_failure": self.error_on_func_failure, 
+            "eval_zero_as_true":     self.eval_zero_as_true, 
+            "escape_all":            self.escape_all, 
+            "error_on_missing_tags": self.error_on_missing_tags, 
+            "scoped_iterations":     self.scoped_iterations
+        }
+        self.spawn_error_handler = None
+        if self.error_on_func_failure:
+            self.spawn_error_handler = lambda key : lambda exception : self._error_handler_inner(key, exception)
+        # resolve partials, any passed here override those registered to the interface for this render only
+        self.partials = interface.partials.resolve(options["partials"] if "partials" in options else None)
+        self.load_paths = None
+        # compiled render steps (see Template.compile()), if any
+        self.program = self.template.program
+        # timed versions of render methods replace these on this renderer only, if profiling
+        if self.profiler is not None:
+            self.profiler.instrument(self)
+
+    # Set bindings to render. Renderer may be rebound for many renders with the same options.
+    def bind(self, bindings):
+        if isinstance(bindings, Domain):
+            self.root = bindings.reroot()
+        else:
+            # lazy bindings are given every key path the template may touch, to load in one call
+            if isinstance(bindings, Loader) and bindings._loaded is None:
+                bindings.prefetch(self._load_paths())
+            self.root = Domain(bindings)
+        self.root.memo     = self.functions
+        self.root.profiler = self.profiler
+        return self
+
+    # Binding key paths template may touch (see Template.dependencies()), excluding those only known in-context.
+    def _load_paths(self):
+        if self.load_paths is None:
+            found = self.template.dependencies(self.partials)
+            paths = set(found["values"]) | set(found["functions"])
+            for path in found["sections"]:
+                paths |= {path, path + "._display"}
+            self.load_paths = sorted(
+                path for path in paths if not path.startswith(DIRECTIVES.TO_SYMBOL[DIRECTIVES.IN_CONTEXT])
+            )
+        return self.load_paths
+
+    def render(self):
+        return self._render_inside_out(self._render_outside_in(self.template.root))
+
+    # Render as generator, yielding chunks of output as produced.
+    def iter(self):
+        return self._iter_inside_out(self._render_outside_in(self.template.root))
+
+    # Render a single node of the template root on its own, as it would be rendered within the whole template.
+    def render_node(self, node):
+        container = RootNode()
+        container.inner.append(node)
+        return self._render_inside_out(self._render_outside_in(container))
+
+    def _missing_handler(self, key, throw_error=False):
+        if throw_error or self.error_on_missing_tags:
+            raise Exception("Render error: missing binding for {0}".format(key))
+        return ""
+
+    def _error_handler_inner(self, key, exception):
+        if self.error_on_func_failure:
+            raise exception
+        print("Error evaluating bindings at {0}".format(key))
+        print(exception)
+        return ""
+
+    def _process_context(self, node, domain, dynamics=None):
+        on_func_error = self.spawn_error_handler(node.raw) if self.spawn_error_handler else None
+        def search(snode):
+            if not snode.incontext and not snode.rooted and dynamics and len(dynamics):
+                for dy in reversed(dynamics):
+                    if dy.incontext(snode.key):
+                        return dy.search(snode, on_func_error)
+            return domain.search(snode, on_func_error)
+
+        result = Result()
+
+        # get domain of node
+        result.node = search(node)
+        if not result.node:
+            return None
+
+        if not node.func:
+            result.value     = result.node.value(on_func_error)
+            result.isdynamic = result.isrepeating = result.node.isrepeating
+            result.length    = len(result.node.dynamic)
+
+        else:
+            # get domain of function
+            result.func = search(node.func)
+            result.isdynamic = True
+            if not result.func:
+                raise Exception("Context passed to unresolved function at {0}".format(node.raw))
+            if not result.func.function:
+                raise Exception("Context passed to non-function at {0}".format(node.raw))
+
+            call = lambda : evalf(
+                result.func.function, 
+                result.node.value(on_func_error), 
+                self.root.data, 
+                on_func_error, 
+                self.functions
+            )
+            result.value = call() if self.profiler is None else self.profiler.function(result.func.fullkey, call)
+            if is_array(result.value):
+                result.isrepeating = True
+                result.length = len(result.value)
+
+        return result
+
+    def _render_outside_in(self, root, domain=None, processed=None, unresolved=None):
+        domain     = domain if domain else self.root
+        processed  = processed if processed else RootNode()
+        unresolved = unresolved if unresolved else []
+
+        # compiled templates run their precomputed render steps
+        if self.program and root in self.program.steps:
+            return self.program.run(self, root, domain, processed, unresolved)
+
+        for node in root.inner:
+            # skip comments (shouldn't exist but just in case)
+            if node.directive == DIRECTIVES.COMMENT:
+                continue
+
+            # text doesn't need processing
+            if isinstance(node, TextNode):
+                processed.inner.append(node)
+                continue
+
+            # render partial as sub-render with passed data domain and duplicate options
+            if isinstance(node, PartialNode):
+                processed.inner.append(self._partial(node, domain))
+                continue
+
+            # cached sections output as is
+            if self.fragments is not None and isinstance(node, SectionNode) and self.fragments.caches(self.template, node):
+                processed.inner.append(self._fragment(node))
+                continue
+
+            # handling nodes in an unresolved context, some exceptions for sections and lists
+            if domain.isrepeating and (node.func and node.func.incontext or node.incontext):
+                processed.inner.append(node)
+                continue
+            for_section = isinstance(node, SectionNode)
+            check_node = not for_section and node.directive != DIRECTIVES.LIST
+            if len(unresolved) and check_node or node.func:
+                cant_resolve = False
+                for u in unresolved:
+                    if check_node and u.incontext(node.key):
+                        cant_resolve = True
+                    elif node.func and u.incontext(node.func.key):
+                        cant_resolve = True
+                if cant_resolve:
+                    processed.inner.append(node)
+                    continue
+
+            # get data context -- if null, likely due to nesting into dynamic data, so defer processing
+            context = self._process_context(node, domain)
+            if context is None:
+                processed.inner.append(node)
+                continue
+
+            # render sections (handler split out, but basically recurses here)
+            if for_section:
+                self._section(node, context, processed, unresolved)
+                continue
+
+            # render straight values unless it depends on dynamic context (those defer till 2nd round)
+            processed.inner.append(self._render_value(node, context.value))
+
+        return processed
+
+    def _render_inside_out(self, root, domain=None, dynamics=None):
+        domain   = domain if domain else self.root
+        dynamics = dynamics if dynamics else []
+
+        # only handle sections for this first outside-in loop
+        processed = []
+        for node in root.inner:
+            if not isinstance(node, SectionNode):
+                processed.append(node)
+            else:
+                processed.append("".join(self._iter_section(node, domain, dynamics)))
+
+        # this part will run from inner-most out on all remaining nodes
+        text = []
+        for node in processed:
+            if isinstance(node, TextNode):
+                text.append(node.text)
+            elif isinstance(node, str):
+                text.append(node)
+            elif not isinstance(node, Node):
+                text.append(str(node))
+            else:
+                context = self._process_context(node, domain, dynamics)
+                if context is None:
+                    text.append(self._missing_handler(node.raw))
+                else:
+                    text.append(self._render_value(node, context.value))
+        return "".join(text)
+
+    # Streaming version of _render_inside_out(). As sections must be evaluated before any remaining tags at the 
+    # same level (function bindings may be order-dependent), levels with remaining tags are rendered whole.
+    def _iter_inside_out(self, root, domain=None, dynamics=None):
+        domain   = domain if domain else self.root
+        dynamics = dynamics if dynamics else []
+
+        for node in root.inner:
+            if isinstance(node, Node) and not isinstance(node, (TextNode, SectionNode)):
+                yield self._render_inside_out(root, domain, dynamics)
+                return
+
+        for node in root.inner:
+            if isinstance(node, SectionNode):
+                yield from self._iter_section(node, domain, dynamics)
+            elif isinstance(node, TextNode):
+                yield node.text
+            elif isinstance(node, str):
+                yield node
+            else:
+                yield str(node)
+
+    def _iter_section(self, node, domain, dynamics):
+        # get context, missing here is either skip or exception thrown
+        context = self._process_context(node, domain, dynamics)
+        if context is None:
+            self._missing_handler(node.raw)
+            return
+        # convert to dynamic domain, if necessary
+        use_domain = context.get_domain()
+
+        # standard section bound to context within a dynamic data domain
+        if not context.isrepeating:
+            if self._display(node.inclusive, use_domain):
+                yield from self._iter_inside_out(node, use_domain, dynamics)
+            return
+
+        # only thing left is repeating sections, exclusive ones only rendered here if deferred (see _repeats_exclusive())
+        if not node.inclusive and not self._repeats_exclusive(node, dynamics):
+            return
+        pieces = []
+        for i in range(context.length):
+            dydom = use_domain.dynamic.get(i, None, not self.scoped_iterations)
+            dynamics.append(dydom)
+            if self._display(True, dydom):
+                # grammatic lists need all pieces first, otherwise stream each item
+                if node.list:
+                    pieces.append(self._render_inside_out(node, dydom, dynamics))
+                else:
+                    yield from self._iter_inside_out(node, dydom, dynamics)
+            dynamics.pop(-1)
+        # convert to grammatic list
+        plen = len(pieces)
+        if plen == 0:
+            pass
+        elif plen == 1:
+            yield pieces[0]
+        elif plen == 2:
+            yield "{0} and {1}".format(pieces[0], pieces[1])
+        else:
+            last = pieces.pop(-1)
+            yield "{0}, and {1}".format(", ".join(pieces), last)
+
+    # Whether an exclusive section over a list is rendered once per item, as a section over each. The outside-in pass
+    # drops these, so any reaching the inside-out pass were deferred past it, and are.
+    def _repeats_exclusive(self, node, dynamics):
+        return True
+
+    # Rendered output of a cached section (see FragmentCache). These resolve the same wherever rendered, so on a miss
+    # are rendered on their own, as if the only thing in the template.
+    def _fragment(self, node):
+        def render():
+            processed = RootNode()
+            context = self._process_context(node, self.root)
+            if context is None:
+                processed.inner.append(node)
+            else:
+                self._section(node, context, processed, [])
+            return self._render_inside_out(processed)
+        return self.fragments.get(self, node, render)
+
+    def _section(self, node, context, processed, unresolved):
+        # Repeating sections recurse inner content to process any non-dynamic referencing tags, but also add 
+        # node to processing array for final processing in inside-out rendering.
+        if context.isrepeating:
+            if node.inclusive and context.length:
+                # Copy section node and replace any in-context shortcuts with full path as it will be handled
+                # later, potentially out of context.
+                dynode = SectionNode(node, None)
+                if dynode.incontext:
+                    dynode.key = context.node.fullkey
+                    dynode.incontext = False
+                    dynode._finish()
+                if dynode.func and dynode.func.incontext:
+                    dynode.func.key = context.func.fullkey
+                    dynode.func.incontext = False
+                    dynode.func._finish()
+                domain = context.get_domain()
+                # Add to unresolved domains, recurse, pop unresolved domain, add to processing
+                unresolved.append(domain)
+                self._render_outside_in(node, domain, dynode, unresolved)
+                unresolved.pop(-1)
+                processed.inner.append(dynode)
+        # Standard sections simple recurse inner content to render. Only thing is checking for creation of 
+        # dynamic data context first.
+        else:
+            domain = context.get_domain()
+            if self._display(node.inclusive, domain):
+                self._render_outside_in(node, domain, processed, unresolved)
+
+    def _display(self, inclusive, domain):
+        display = domain.value()
+        if domain.type == TYPES.OBJECT:
+            _display = domain.get("_display")
+            if _display is not None:
+                return _display.value()
+        elif domain.type == TYPES.ARRAY and not len(display):
+            # discrepancy from javascript where empty arrays are still truthy
+            display = True
+        else:
+            if isinstance(display, str):
+                display = display.strip()
+            elif isinstance(display, (int, float)):
+                display = display if display != 0 else self.eval_zero_as_true
+        return inclusive == bool(display)
+
+    def _partial(self, node, context):
+        partial = self.partials.get(node.key)
+        if not partial:
+            if self.error_on_missing_tags:
+                raise Exception("Render error: missing partial for {0}".format(node.key))
+            print("Render error: missing partial for {0}".format(node.key))
+            return ""
+        try:
+            # already escaped as needed within the partial
+            interface = type(self.interface)(partial, {
+                "partials":       self.partials, 
+                "engine":         self.interface.engine, 
+                "fragment_cache": self.fragments, 
+                "function_cache": self.functions, 
+                "profiler":       self.profiler
+            })
+            return Markup(interface.render(context if node.incontext else self.root, self.options))
+        except Exception as e:
+            print("Partial render error for {0}".format(node.key))
+            print(e)
+            return ""
+
+    def _render_value(self, node, value):
+        vtype = type_of(value)
+        if vtype <= TYPES.NULL:
+            return ""
+        escape = node.escape if node.escape is not None else self.escape_all
+        # format list (unless not array, then normal handling)
+        if node.directive == DIRECTIVES.LIST and vtype == TYPES.ARRAY:
+            value = [
+                str(vi) if is_array(vi) else apply_format(node.formatter, vi, escape)
+                for vi in value
+            ]
+            vlen = len(value)
+            if vlen == 0:
+                return ""
+            if vlen == 1:
+                return value[0]
+            if vlen == 2:
+                return "{0} and {1}".format(value[0], value[1])
+            else:
+                last = value.pop(-1)
+                return "{0}, and {1}".format(", ".join(value), last)
+        # other non-value types, convert to string (ignoring format)
+        if vtype == TYPES.ARRAY:
+            value = str(value)
+            return escape_html(value) if escape else value
+        elif vtype == TYPES.OBJECT:
+            value = json.dumps(value, default=str)
+            return escape_html(value) if escape else value
+        # final format and add
+        if isinstance(value, Markup):
+            return value
+        return node.formatter(value, escape)
@@ -0,0 +1,116 @@
+from lib.nodes import TextNode
+from lib.misc import TYPES, type_of
+from lib.template import node_dependencies, fallback_paths
+import json
+
+
+# Output of one node at the template root, with the key paths it depends on.
+class _Part:
+    __slots__ = ("node", "paths", "fingerprint", "output", "redo")
+
+    def __init__(self, node, paths, output=""):
+        self.node        = node
+        self.paths       = paths
+        self.fingerprint = None
+        self.output      = output
+        self.redo        = False
+
+
+# Render session keeping the output of each part of the template (each node at the template root) along with the
+# binding key paths it depends on (see Template.dependencies()), including those in-context tags fall back to (see
+# fallback_paths()). On update, only parts depending on changed bindings are rendered again. Parts depending on
+# function bindings (or the whole bindings, e.g. {{.}}) can't be tracked, as functions may read anything, so are
+# always rendered again.
+class RenderSession:
+
+    def __init__(self, renderer, bindings):
+        self.renderer = renderer
+        self.bindings = bindings
+        self.parts    = []
+        for node in renderer.template.root.inner:
+            if isinstance(node, TextNode):
+                self.parts.append(_Part(node, None, node.text))
+                continue
+            found = node_dependencies(node, renderer.partials)
+            paths = found["values"] | found["sections"] | found["functions"] | fallback_paths(node)
+            self.parts.append(_Part(node, paths))
+        self.renderer.bind(bindings)
+        for part in self.parts:
+            if part.paths is not None:
+                part.fingerprint = self._fingerprint(part)
+                part.output      = self.renderer.render_node(part.node)
+        self.output = "".join(part.output for part in self.parts)
+
+    # Update render after bindings changed. Either pass new bindings, in which case parts are rendered again if any
+    # binding value they depend on differs, or the key paths changed (after modifying bindings in place), in which
+    # case only parts depending on those are rendered again. If neither, the current bindings are compared to those
+    # last rendered. Returns the new output and list of (start, end) spans of the output that changed.
+    def update(self, bindings=None, changed=None):
+        if bindings is not None:
+            self.bindings = bindings
+        self.renderer.bind(self.bindings)
+        for part in self.parts:
+            part.redo = False
+            if part.paths is None:
+                continue
+            if changed is not None and part.fingerprint is not False:
+                if not any(_overlaps(path, key) for path in part.paths for key in changed):
+                    continue
+                part.fingerprint = self._fingerprint(part)
+            else:
+                fingerprint = self._fingerprint(part)
+                if fingerprint is not False and fingerprint == part.fingerprint:
+                    continue
+                part.fingerprint = fingerprint
+            part.redo = True
+        # render changed parts, merging adjacent spans of changed output
+        spans = []
+        start = 0
+        for part in self.parts:
+            if part.redo:
+                rendered = self.renderer.render_node(part.node)
+                if rendered != part.output:
+                    part.output = rendered
+                    if spans and spans[-1][1] == start:
+                        spans[-1] = (spans[-1][0], start + len(rendered))
+                    else:
+                        spans.append((start, start + len(rendered)))
+            start += len(part.output)
+        if spans:
+            self.output = "".join(part.output for part in self.parts)
+        return self.output, spans
+
+    # Fingerprint of the binding values a part depends on, or False if it can't be tracked (e.g. anything within is a
+    # function, or not plain data). Values are serialized, so in-place modifications are caught as well.
+    def _fingerprint(self, part):
+        if not part.paths:
+            return False
+        values = []
+        for path in sorted(part.paths):
+            value = self.renderer.root.data
+            for key in path.split("."):
+                if type_of(value) != TYPES.OBJECT:
+                    break
+                value = value[key] if key in value else None
+            values.append(value)
+        try:
+            serialized = json.dumps(values, sort_keys=True)
+        except (TypeError, ValueError):
+            return False
+        # serialized, so no cycles, but callable dictionaries or lists would be taken as data
+        return False if _has_function(values) else serialized
+
+
+def _has_function(value):
+    vtype = type_of(value)
+    if vtype == TYPES.FUNCTION or callable(value):
+        return True
+    if vtype == TYPES.OBJECT:
+        return any(_has_function(inner) for inner in value.values())
+    if vtype == TYPES.ARRAY:
+        return any(_has_function(inner) for inner in value)
+    return False
+
+
+def _overlaps(path, key):
+    return path == key or path.startswith(key + ".") or key.startswith(path + ".")
@@ -0,0 +1,185 @@
+from lib.nodes import TextNode, MappedTextNode, PartialNode, SectionNode
+from lib.renderer import Renderer
+from lib.template import all_static, is_static, has_incontext
+
+
+# Single-pass rendering engine. Instead of rendering all non-dynamic tags outside-in into an intermediate tree, then
+# walking that tree again inside-out to resolve dynamic contexts, renders the template tree in one traversal. Each
+# level renders its sections first, then its remaining tags, as the inside-out render does. Within repeating
+# sections, any tag or section whose data does not depend on the item (see _find_static()) is rendered once per
+# render and reused for every item, as it would have been rendered once in the outside-in pass.
+#
+# Output matches the default engine except where function bindings have side effects that depend on evaluation
+# order across different sections at the same level, partials within repeating sections, which here are rendered
+# with the data context of each item, and in-context tags missing from their section, which the default engine
+# re-tries against the root data in its inside-out pass.
+class SinglePassRenderer(Renderer):
+
+    def __init__(self, interface, options=None):
+        super().__init__(interface, options)
+        self.static, self.contextual, self.layouts = _analyze(self.template)
+        self.memo    = {}
+        self.varying = 0
+
+    def bind(self, bindings):
+        self.memo = {}
+        return super().bind(bindings)
+
+    def render(self):
+        return self._render_inside_out(self.template.root)
+
+    def iter(self):
+        return self._iter_inside_out(self.template.root)
+
+    def render_node(self, node):
+        if isinstance(node, TextNode):
+            return node.text
+        if isinstance(node, SectionNode):
+            return self._render_section(node, self.root, [])
+        return self._render_tag(node, self.root, [])
+
+    def _render_inside_out(self, root, domain=None, dynamics=None):
+        domain   = domain if domain else self.root
+        dynamics = dynamics if dynamics else []
+        self._mark_varying(root, domain, dynamics)
+
+        parts, sections, tags, mapped = self.layouts[root]
+        parts = list(parts)
+        for i, node in mapped:
+            parts[i] = node.text
+        # sections first, then all remaining tags
+        for i, node in sections:
+            parts[i] = self._render_section(node, domain, dynamics)
+        for i, node in tags:
+            parts[i] = self._render_tag(node, domain, dynamics)
+        return "".join(parts)
+
+    def _iter_inside_out(self, root, domain=None, dynamics=None):
+        domain   = domain if domain else self.root
+        dynamics = dynamics if dynamics else []
+
+        parts, sections, tags, mapped = self.layouts[root]
+        if tags:
+            yield self._render_inside_out(root, domain, dynamics)
+            return
+        self._mark_varying(root, domain, dynamics)
+        if mapped:
+            parts = list(parts)
+            for i, node in mapped:
+                parts[i] = node.text
+
+        last = 0
+        for i, node in sections:
+            if last < i:
+                yield "".join(parts[last:i])
+            if self._reuses(node, domain, dynamics) or (self.fragments is not None and self.fragments.caches(self.template, node)):
+                yield self._render_section(node, domain, dynamics)
+            else:
+                yield from self._iter_section(node, domain, dynamics)
+            last = i + 1
+        if last < len(parts):
+            yield "".join(parts[last:])
+
+    # Exclusive sections over lists are only rendered per item where the default engine defers them to its inside-out
+    # pass, i.e. in-context within a repeating section item.
+    def _repeats_exclusive(self, node, dynamics):
+        return bool(dynamics) and bool(has_incontext(node))
+
+    # Count renders of in-context content for each item of a repeating section. Such content would have been deferred
+    # past the outside-in pass in the default engine, so any section enclosing it is not reused.
+    def _mark_varying(self, root, domain, dynamics):
+        if dynamics and domain is dynamics[-1] and root in self.contextual:
+            self.varying += 1
+
+    # Whether node is rendered once and reused for every item. In-context to the item itself, it varies with each.
+    def _reuses(self, node, domain, dynamics):
+        return bool(dynamics) and node in self.static and not (domain is dynamics[-1] and has_incontext(node))
+
+    def _render_section(self, node, domain, dynamics):
+        if self.fragments is not None and self.fragments.caches(self.template, node):
+            return self.fragments.get(self, node, lambda : "".join(self._iter_section(node, domain, dynamics)))
+        if self._reuses(node, domain, dynamics):
+            if node in self.memo:
+                return self.memo[node]
+            varying = self.varying
+            rendered = "".join(self._iter_section(node, domain, dynamics))
+            if self.varying == varying:
+                self.memo[node] = rendered
+            return rendered
+        return "".join(self._iter_section(node, domain, dynamics))
+
+    def _render_tag(self, node, domain, dynamics):
+        if self._reuses(node, domain, dynamics):
+            if node not in self.memo:
+                self.memo[node] = self._render_tag_inner(node, domain, dynamics)
+            return self.memo[node]
+        return self._render_tag_inner(node, domain, dynamics)
+
+    def _render_tag_inner(self, node, domain, dynamics):
+        if isinstance(node, PartialNode):
+            return self._partial(node, domain)
+        context = self._process_context(node, domain, dynamics)
+        if context is None:
+            return self._missing_handler(node.raw)
+        return self._render_value(node, context.value)
+
+
+# Static nodes of template, containers with in-context content, and layout of each container, found once and stored
+# on the template.
+def _analyze(template):
+    analysis = getattr(template, "single_pass", None)
+    if analysis is None:
+        static, contextual, layouts = set(), set(), {}
+        _find_static(template.root, True, static)
+        _find_contextual(template.root, contextual)
+        _layout(template.root, layouts)
+        analysis = template.single_pass = (static, contextual, layouts)
+    return analysis
+
+
+# Layout of a container as its text parts, with placeholders at the positions of its sections and remaining tags. Text
+# mapped from a file (see Template.from_file()) is read as rendered instead of copied into the layout.
+def _layout(container, layouts):
+    parts, sections, tags, mapped = [], [], [], []
+    for i, node in enumerate(container.inner):
+        if isinstance(node, MappedTextNode):
+            parts.append("")
+            mapped.append((i, node))
+            continue
+        if isinstance(node, TextNode):
+            parts.append(node.text)
+            continue
+        parts.append("")
+        if isinstance(node, SectionNode):
+            sections.append((i, node))
+            _layout(node, layouts)
+        else:
+            tags.append((i, node))
+    layouts[container] = (parts, sections, tags, mapped)
+
+
+# Find nodes whose output never depends on the item of an enclosing repeating section. These resolve from the root
+# regardless of context (see Template scope resolution), or are in-context within a section that does. Sections must
+# also have everything within them either resolve from the root or in-context to a section within. In-context content
+# rendered for each item of such a section still varies, which is checked when rendering.
+def _find_static(container, within_static, found):
+    for node in container.inner:
+        if isinstance(node, TextNode):
+            continue
+        static = is_static(node, within_static)
+        if isinstance(node, SectionNode):
+            if static and all_static(node):
+                found.add(node)
+            _find_static(node, static, found)
+        elif static:
+            found.add(node)
+
+
+def _find_contextual(container, found):
+    for node in container.inner:
+        if isinstance(node, TextNode):
+            continue
+        if has_incontext(node):
+            found.add(container)
+        if isinstance(node, SectionNode):
+            _find_contextual(node, found)
@@ -1,53 +1,293 @@
-from lib.nodes import RootNode, TextNode, TagNode, PartialNode, SectionNode
+from lib.nodes import RootNode, TextNode, MappedTextNode, TagNode, PassToFunctionNode, PartialNode, SectionNode
 from lib.directives import DIRECTIVES
+from lib.compiler import Program
+from lib.misc import compile_format
+import os, sys, mmap, marshal, hashlib
 
 
 DEFAULT = {
-    "delimiters": ["{{", "}}"]
+    "delimiters": ["{{", "}}"], 
+    "compile":    False, 
+    "map_size":   1 << 20
 }
 
 
+# Max number of possible data paths tracked for a section before treating it as unknown.
+_MAX_PATHS = 64
+
+
+# Possible data paths of a section, or None if too many to track. Sections not in-context are always from the root.
+# In-context sections are under their enclosing section's path, but if deferred to the inside-out render (e.g. when
+# not resolvable in the outside-in render), they may be resolved from the domain of any enclosing section instead.
+def _section_paths(node, enclosing):
+    if not node.incontext:
+        return {node.key}
+    paths = {node.key} if node.key else set()
+    for within in enclosing:
+        if within is None:
+            return None
+        for path in within:
+            paths.add(path + "." + node.key if node.key else path)
+    return paths if len(paths) <= _MAX_PATHS else None
+
+
+# Statically resolve node scope. Keys not in-context are always from the root, but at render time a search may be
+# caught by a dynamic (e.g. repeating section item) data domain of any enclosing section whose path prefixes the key.
+# If no possible path of any enclosing section does, the search always resolves from the root, so node is marked.
+def _resolve_scope(node, enclosing):
+    known = None not in enclosing
+    for snode in ([node, node.func] if node.func else [node]):
+        snode.rooted = known and not snode.incontext and not any(
+            path and (snode.key == path or snode.key.startswith(path + "."))
+            for paths in enclosing for path in paths
+        )
+
+
+# Whether node (or its pass-to-function target) is in-context.
+def has_incontext(node):
+    return node.incontext or (not isinstance(node, PartialNode) and node.func and node.func.incontext)
+
+
+# Whether node always resolves to the same data wherever rendered, given whether its enclosing section does. Nodes not
+# in-context must always resolve from the root (see _resolve_scope()).
+def is_static(node, within_static):
+    if isinstance(node, PartialNode):
+        return within_static or not node.incontext
+    if node.func and not (within_static if node.func.incontext else node.func.rooted):
+        return False
+    return within_static if node.incontext else node.rooted
+
+
+# Whether everything within container either resolves from the root or is in-context to a section within.
+def all_static(container):
+    for node in container.inner:
+        if isinstance(node, TextNode):
+            continue
+        if not is_static(node, True) or (isinstance(node, SectionNode) and not all_static(node)):
+            return False
+    return True
+
+
+# Full key paths a node may refer to, given the key paths of its enclosing sections. In-context keys are under the
+# innermost enclosing section's paths. If those are unknown, the relative key (with leading in-context directive) is
+# used instead.
+def _key_paths(node, enclosing):
+    if not node.incontext or not enclosing:
+        return {node.key} if node.key else set()
+    within = enclosing[-1]
+    if within is None:
+        return {DIRECTIVES.TO_SYMBOL[DIRECTIVES.IN_CONTEXT] + node.key}
+    return set(path + "." + node.key if node.key else path for path in within)
+
+
+def _prefix_paths(prefixes, paths):
+    if not prefixes:
+        return set(paths)
+    return set(prefix + "." + path if prefix and path else prefix or path for prefix in prefixes for path in paths)
+
+
+def _dependencies(container, enclosing, found, partials, visited):
+    for node in container.inner:
+        if isinstance(node, TextNode) or node.directive == DIRECTIVES.COMMENT:
+            continue
+        if isinstance(node, PartialNode):
+            found["partials"].add(node.key)
+            partial = partials.get(node.key) if partials else None
+            if partial is None or node.key in visited:
+                continue
+            # in-context partials render with the current data context as their root
+            prefixes = enclosing[-1] if node.incontext and enclosing else set()
+            if prefixes is None:
+                continue
+            included = dict((role, set()) for role in found)
+            _dependencies(partial.root, [], included, partials, visited | {node.key})
+            for role, paths in included.items():
+                found[role] |= paths if role == "partials" else _prefix_paths(prefixes, paths)
+            continue
+        paths = _key_paths(node, enclosing)
+        if node.func:
+            found["functions"] |= _key_paths(node.func, enclosing)
+        if not isinstance(node, SectionNode):
+            found["values"] |= paths
+            continue
+        found["sections"] |= paths
+        # content rendered per item if section data is an array
+        if node.list or (node.inclusive and any(
+            not isinstance(inner, TextNode) and inner.directive != DIRECTIVES.COMMENT and has_incontext(inner)
+            for inner in node.inner
+        )):
+            found["repeating"] |= paths
+        known = paths and not any(path.startswith(DIRECTIVES.TO_SYMBOL[DIRECTIVES.IN_CONTEXT]) for path in paths)
+        _dependencies(node, enclosing + [paths if known else None], found, partials, visited)
+
+
+# Binding key paths a node depends on, by role (as Template.dependencies()), with the node treated as though at the
+# root. Only meaningful for nodes that resolve the same wherever rendered (see all_static()).
+def node_dependencies(node, partials=None):
+    container = RootNode()
+    container.inner.append(node)
+    found = {"values": set(), "sections": set(), "repeating": set(), "functions": set(), "partials": set()}
+    _dependencies(container, [], found, partials, set())
+    return found
+
+
+# Key paths in-context tags within node also refer to if missing from their section's data, as the default engine
+# re-tries those against the root bindings.
+def fallback_paths(node):
+    found = set()
+    _fallbacks(node, found)
+    return found
+
+
+def _fallbacks(node, found):
+    if isinstance(node, (TextNode, PartialNode)) or node.directive == DIRECTIVES.COMMENT:
+        return
+    if node.incontext and node.key:
+        found.add(node.key)
+    if node.func and node.func.incontext and node.func.key:
+        found.add(node.func.key)
+    if isinstance(node, SectionNode):
+        for inner in node.inner:
+            _fallbacks(inner, found)
+
+
+# Serialized form of parsed templates (see Template.dumps()). Nodes are flattened into tuples of their attributes,
+# with text nodes as plain strings. Compiled format directives and section parents are rebuilt on load instead.
+# Increase the format whenever what the parser produces changes (node attributes, directives, scope resolution), not
+# only the layout here, so templates serialized before are rebuilt.
+_SERIAL_FORMAT = 3
+_SERIAL_TYPES  = (RootNode, TagNode, PassToFunctionNode, PartialNode, SectionNode)
+_SERIAL_INDEX  = dict((cls, i) for i, cls in enumerate(_SERIAL_TYPES))
+
+
+# Version of the serialized form, from the format and the Python and marshal versions. Derived from constants only,
+# so works the same where the library is installed as bytecode or in a zip.
+def serial_version():
+    return "{0}-{1}-{2}.{3}-{4}".format(
+        _SERIAL_FORMAT, sys.implementation.name, sys.version_info[0], sys.version_info[1], marshal.version
+    )
+
+
+def _encode(node):
+    if isinstance(node, TextNode):
+        return node.text
+    data = (
+        _SERIAL_INDEX[type(node)], 
+        node.key, 
+        node.keysplit, 
+        node.raw, 
+        [_encode(inner) for inner in node.inner] if node.inner is not None else None, 
+        node.directive, 
+        node.incontext, 
+        _encode(node.func) if node.func is not None else None, 
+        node.escape, 
+        node.rooted
+    )
+    if isinstance(node, TagNode):
+        return data + (node.format,)
+    if isinstance(node, SectionNode):
+        return data + (node.inclusive, _encode(node.open), node.list)
+    return data
+
+
+# Attributes are set directly instead of through constructors, which would parse tags again. Loading is mostly node
+# creation, so this is kept as lean as possible.
+def _decode(data, parent=None):
+    if data.__class__ is str:
+        node = TextNode.__new__(TextNode)
+        node.key       = ""
+        node.keysplit  = ()
+        node.raw       = node.inner = node.directive = node.incontext = node.func = node.escape = None
+        node.rooted    = False
+        node.text      = data
+        return node
+    cls  = _SERIAL_TYPES[data[0]]
+    node = cls.__new__(cls)
+    _, node.key, node.keysplit, node.raw, inner, node.directive, node.incontext, func, node.escape, node.rooted = data[:10]
+    node.inner = [_decode(child, node) for child in inner] if inner is not None else None
+    node.func  = _decode(func) if func is not None else None
+    if cls is TagNode:
+        node.format    = data[10]
+        node.formatter = compile_format(node.format)
+    elif cls is SectionNode:
+        node.parent    = parent
+        node.inclusive = data[10]
+        node.open      = _decode(data[11])
+        node.list      = data[12]
+    return node
+
+
+# Text node for spans of template text, as offsets into the template if mapped (see Template.from_file()).
+def _text_node(template, spans, mapped):
+    if mapped:
+        return MappedTextNode(template, spans)
+    if len(spans) == 1:
+        return TextNode(template[spans[0][0]:spans[0][1]])
+    return TextNode("".join(template[start:end] for start, end in spans))
+
+
 class Template:
 
+    _digest = None
+
+    # Template may be a string, or the bytes-like contents of a UTF-8 file (e.g. a memory mapping, see from_file()), in
+    # which case text is kept as offsets into it instead of copied out.
     def __init__(self, template, options=None):
-        self.root  = RootNode()
-        delimiters = DEFAULT["delimiters"]
-        last       = 0
-        search     = 0
-        dopen      = 0
-        start      = -1
-        dclose     = -1
-        current    = self.root
-        nest       = 0
-        raw        = None
-        node       = None
+        self.root    = RootNode()
+        self.program = None
+        delimiters   = DEFAULT["delimiters"]
+        last         = 0
+        search       = 0
+        dopen        = 0
+        start        = -1
+        dclose       = -1
+        current      = self.root
+        nest         = 0
+        raw          = None
+        node         = None
+        text         = []  # pending (start, end) text spans, made a single text node when the next tag is hit
+        paths        = []  # possible data paths of open sections
+        mapped       = not isinstance(template, str)
+        escape       = b"!" if mapped else "!"
         if options and "delimiters" in options:
             delimiters = options["delimiters"]
+        # kept to parse partials given as strings with the same delimiters (see dependencies())
+        self.delimiters = list(delimiters)
+        if mapped:
+            delimiters = [delimiter.encode("utf-8") for delimiter in delimiters]
+        lopen  = len(delimiters[0])
+        lclose = len(delimiters[1])
         while True:
             # find opening delimiter
             dopen = template.find(delimiters[0], search)
             if dopen < 0:
                 break
-            start = dopen + len(delimiters[0])
+            start = dopen + lopen
             # find closing delimiter
-            dclose = template.find(delimiters[1], search)
+            dclose = template.find(delimiters[1], start)
             if dclose < 0:
                 break
             # update search position
-            search = dclose + len(delimiters[1])
-            # ignore escaped (remove directive character in template)
-            if template[dopen-1] == "!":
-                template = template[0:dopen-1] + template[dopen:]
-                search -= 1
+            search = dclose + lclose
+            # ignore escaped (skip directive character, tag is left as text)
+            if dopen and template[dopen-1:dopen] == escape:
+                if dopen - 1 > last:
+                    text.append((last, dopen-1))
+                last = dopen
                 continue
             # grab preceding content
-            if dopen and dopen > last:
-                current.inner.append(TextNode(template[last:dopen]))
+            if dopen > last:
+                text.append((last, dopen))
+            if text:
+                current.inner.append(_text_node(template, text, mapped))
+                text = []
             last = search
             # create node and handle
-            node = TagNode(
-                template[dopen:search], 
-                template[start:dclose].strip()
+            raw   = template[dopen:search]
+            inner = template[start:dclose]
+            node  = TagNode(
+                raw.decode("utf-8") if mapped else raw, 
+                (inner.decode("utf-8") if mapped else inner).strip()
             )
             # ignore comments
             if node.directive == DIRECTIVES.COMMENT:
@@ -59,22 +299,115 @@ class Template:
                 if current.open.key != node.key:
                     raise Exception("Invalid template: Invalid template: section conflict at {0} close before inner {1} closed".format(node.raw, current.open.raw))
                 current = current.parent
+                paths.pop(-1)
                 nest -= 1
             elif node.directive in (DIRECTIVES.LIST_SECTION, DIRECTIVES.SECTION_INC, DIRECTIVES.SECTION_EXC):
                 section = SectionNode(node, current)
+                _resolve_scope(section, paths)
                 current.inner.append(section)
                 current = section
+                paths.append(_section_paths(section, paths))
                 nest += 1
             # convert partials
             elif node.directive == DIRECTIVES.PARTIAL:
                 node = PartialNode(node)
                 current.inner.append(node)
             else:
+                _resolve_scope(node, paths)
                 current.inner.append(node)
         # push last text
         if last < len(template):
-            current.inner.append(TextNode(template[search:]))
+            text.append((last, len(template)))
+        if text:
+            current.inner.append(_text_node(template, text, mapped))
         # final error check
         if current != self.root:
             raise Exception("Invalid template: hanging open section for {0}".format(current.open.raw))
-        
\ No newline at end of file
+        if options and "compile" in options and options["compile"]:
+            self.compile()
+
+    # Compiled programs hold closures, so are dropped when pickled and recompiled on load.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["program"] = bool(self.program)
+        return state
+
+    def __setstate__(self, state):
+        compiled = state["program"]
+        state["program"] = None
+        self.__dict__.update(state)
+        if compiled:
+            self.compile()
+
+    # Parse template from a UTF-8 file. Files of at least map_size bytes (in options) are memory-mapped and parsed in
+    # place, with text kept as offsets into the mapping and decoded as rendered, so memory held stays close to that of
+    # the tags alone however large. Smaller files (and empty ones, which can't be mapped) are simply read. The mapping
+    # is kept open as long as the template is, and reading past the end of a mapped file truncated since crashes the
+    # process (SIGBUS), so mapped files must not be truncated or rewritten in place while in use (replace them by
+    # renaming a new file over them instead).
+    @classmethod
+    def from_file(cls, path, options=None):
+        map_size = options["map_size"] if options and "map_size" in options else DEFAULT["map_size"]
+        with open(path, "rb") as fp:
+            size = os.fstat(fp.fileno()).st_size
+            if not size or size < map_size:
+                return cls(fp.read().decode("utf-8"), options)
+            mapping = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapping, options)
+
+    # Serialize parsed template to bytes, to load again with Template.loads() without re-parsing. Only loadable by
+    # the same version of this library and Python (see serial_version()).
+    def dumps(self):
+        return marshal.dumps((serial_version(), bool(self.program), self.delimiters, _encode(self.root)))
+
+    # Load template serialized with dumps(). Raises an exception if not valid or serialized by another version.
+    @classmethod
+    def loads(cls, data):
+        try:
+            version, compiled, delimiters, root = marshal.loads(data)
+        except Exception as e:
+            raise Exception("Invalid serialized template: {0}".format(e))
+        if version != serial_version():
+            raise Exception("Invalid serialized template: version {0} does not match {1}".format(version, serial_version()))
+        template = cls.__new__(cls)
+        template.root       = _decode(root)
+        template.program    = None
+        template.delimiters = delimiters
+        if compiled:
+            template.compile()
+        return template
+
+    # Binding key paths the template refers to, grouped by role: "values" (value and list tags), "sections",
+    # "repeating" (sections whose content is rendered per item if given an array), "functions" (targets of the
+    # pass-to-function directive), and "partials" (partial names). In-context keys are given as full paths from the
+    # root bindings. If partials (a Partials registry or dictionary) is given, the dependencies of included partials
+    # are merged in as well, with any given as template strings parsed with this template's delimiters.
+    def dependencies(self, partials=None):
+        if partials and not hasattr(partials, "compile"):
+            # import here to avoid circular import with lib.partials
+            from lib.partials import Partials
+            partials = Partials(partials, {"delimiters": self.delimiters})
+        found = {"values": set(), "sections": set(), "repeating": set(), "functions": set(), "partials": set()}
+        _dependencies(self.root, [], found, partials, set())
+        return dict((role, sorted(paths)) for role, paths in found.items())
+
+    # Hash of the parsed content, the same for templates parsed from the same source (e.g. to key cached output of
+    # partials by content, not identity). Found once per template.
+    def digest(self):
+        if self._digest is None:
+            self._digest = hashlib.sha1(marshal.dumps(_encode(self.root))).hexdigest()
+        return self._digest
+
+    # Precompute the outside-in render pass into render steps (see lib.compiler). Once compiled, interfaces rendering
+    # this template run those steps instead of checking each node in that pass.
+    def compile(self):
+        if not self.program:
+            self.program = Program(self.root)
+        return self
+
+
+# Parse template, or get it from the disk cache given in options, if any (see lib.cache.DiskTemplateCache).
+def parse(template, options=None):
+    if options and "disk_cache" in options and options["disk_cache"] is not None:
+        return options["disk_cache"].get(template, options, Template)
+    return Template(template, options)
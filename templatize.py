@@ -1,13 +1,43 @@
 from lib.interface import Interface
-from lib.template import Template
+from lib.template import Template, parse
+from lib.cache import TemplateCache, DiskTemplateCache, FragmentCache, FunctionCache
+from lib.partials import Partials
+from lib.loader import Loader
+from lib.profiler import Profiler
+from lib.misc import TYPES, Markup, register_type, memoize
 
 
 class Templatize:
 
+    # process-wide cache of parsed templates used by render()
+    cache = TemplateCache()
+
     @staticmethod
     def render(template, bindings, options=None):
-        return Templatize.make(template, options).render(bindings, options)
+        return Interface(Templatize.cache.get(template, options, parse), options).render(bindings, options)
 
     @staticmethod
     def make(template, options=None):
-        return Interface(Template(template, options), options)
+        return Interface(parse(template, options), options)
+
+    # Make interface from a template file, memory-mapped and parsed in place if large (see Template.from_file()).
+    @staticmethod
+    def make_file(path, options=None):
+        return Interface(Template.from_file(path, options), options)
+
+    # Declare how a custom type is treated in bindings, as TYPES.VALUE, ARRAY, DICTIONARY, or FUNCTION.
+    @staticmethod
+    def register_type(cls, as_type):
+        register_type(cls, as_type)
+
+    @staticmethod
+    def cache_size(size):
+        Templatize.cache.resize(size)
+
+    @staticmethod
+    def cache_stats():
+        return Templatize.cache.stats()
+
+    @staticmethod
+    def clear_cache():
+        Templatize.cache.clear()
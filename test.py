@@ -1,4 +1,6 @@
-from templatize import Templatize
+from templatize import Templatize, TYPES, Markup, DiskTemplateCache, FragmentCache, FunctionCache, Partials, Loader, Profiler, memoize, parse
+import copy, io, os, sys, gc, asyncio, tempfile, datetime
+from concurrent.futures import ThreadPoolExecutor
 
 
 test_basic_1 = {
@@ -74,6 +76,19 @@ test_basic_formatting_2 = {
     }, 
     "expected": r"Order: BURGER and FRIES<br />Prices: $5.00 and $2.00<br />Sale tax: 5%<br />Total: $7.00<br />Total (w/ tax): $7.35"
 }
+class TestTemperature:
+    def __init__(self, degrees):
+        self.degrees = degrees
+    def __format__(self, spec):
+        return "{0:.0f}°F".format(self.degrees*9/5+32) if spec == "F" else "{0:.0f}°C".format(self.degrees)
+test_basic_formatting_3 = {
+    "template": r"Opened {{opened::%Y-%m-%d}} at {{opened::%H:%M}}, grill at {{grill::F}} ({{grill::C}})", 
+    "bindings": {
+      'opened': datetime.datetime(2024, 1, 2, 11, 30), 
+      'grill': TestTemperature(200)
+    }, 
+    "expected": r"Opened 2024-01-02 at 11:30, grill at 392°F (200°C)"
+}
 test_sections_1 = {
     "template": r"{{#job}}Occupation: {{job.title}}{{/job}}<br />{{#jobflat}}Occupation: {{.}}{{/jobflat}}<br />Bob is a {{#jobhide}}{{jobhide.title}}{{/jobhide}}", 
     "bindings": {
@@ -153,6 +168,11 @@ test_sections_7 = {
     "bindings": {'repeat': [1,2,3]} , 
     "expected": r"1 2 3 "
 }
+test_sections_8 = {
+    "template": r"{{#items}}[{{^.tags}}none{{/.tags}}{{#.tags}}{{.}}{{/.tags}}]{{/items}}", 
+    "bindings": {'items': [{'tags': ["a", "b"]}, {'tags': []}, {'tags': [0]}]}, 
+    "expected": r"[nonenoneab][][]"
+}
 test_functions_1 = {
     "template": r"{{fullname}}'s friends include {{&friends}}.", 
     "bindings": {
@@ -299,8 +319,53 @@ test_advanced_7 = {
     "expected": r"1 - 4 - 2 3 <br />1 - 7 - 5 6 <br />1 - 10 - 8 9 <br />"
 }
 
+test_partials_1 = {
+    "template": r"{{>title^}}<br />{{#name}}Owner: {{>fullname}}{{/name}}", 
+    "bindings": {
+      'restaurant': "Bob's Burgers", 
+      'name': {'first': "Bob", 'last': "Belcher"}
+    }, 
+    "options": {
+      "partials": {
+        'title': r"{{restaurant}}", 
+        'fullname': r"{{.first}} {{.last}}"
+      }
+    }, 
+    "expected": r"Bob's Burgers<br />Owner: Bob Belcher"
+}
+
+class TestRecord:
+    def __init__(self, **fields):
+        self.fields = fields
+    def __contains__(self, key):
+        return key in self.fields
+    def __getitem__(self, key):
+        return self.fields[key]
+Templatize.register_type(TestRecord, TYPES.DICTIONARY)
+test_registered_type = {
+    "template": r"{{#owner}}{{.name}} owns {{restaurant.name}}.{{/owner}}", 
+    "bindings": {
+      'owner': TestRecord(name="Bob"), 
+      'restaurant': TestRecord(name="Bob's Burgers")
+    }, 
+    "expected": r"Bob owns Bob's Burgers."
+}
+test_escape_all = {
+    "template": r"{{name}} {{&specials}} {{menu}} {{name::raw}} {{>sign}}", 
+    "bindings": {
+      'name': "<Bob's Burgers>", 
+      'specials': ["Fish & Chips", "\"Burger\""], 
+      'menu': Markup("<b>Burgers</b>")
+    }, 
+    "options": {
+      "escape_all": True, 
+      "partials": {'sign': r"<i>{{name}}</i>"}
+    }, 
+    "expected": r"&lt;Bob&#039;s Burgers&gt; Fish &amp; Chips and &quot;Burger&quot; <b>Burgers</b> <Bob's Burgers> <i>&lt;Bob&#039;s Burgers&gt;</i>"
+}
+
 
-for i,test in enumerate([
+tests = [
     test_basic_1,
     test_basic_2,
     test_basic_list,
@@ -309,6 +374,7 @@ for i,test in enumerate([
     test_basic_context,
     test_basic_formatting_1,
     test_basic_formatting_2,
+    test_basic_formatting_3,
     test_sections_1,
     test_sections_2,
     test_sections_3,
@@ -316,6 +382,7 @@ for i,test in enumerate([
     test_sections_5,
     test_sections_6,
     test_sections_7,
+    test_sections_8,
     test_functions_1,
     test_functions_2,
     test_functions_3,
@@ -326,12 +393,509 @@ for i,test in enumerate([
     test_advanced_4,
     test_advanced_5,
     test_advanced_6,
-    test_advanced_7
-]):
-    print("------Test {0}------".format(i+1))
-    rendered = Templatize.render(test["template"], test["bindings"], test["options"] if "options" in test else None)
-    print(test["expected"])
-    print(rendered)
-    if rendered.strip() != test["expected"].strip():
-        print("---TEST {0} FAILED--".format(i+1))
-        exit()
+    test_advanced_7,
+    test_partials_1,
+    test_registered_type,
+    test_escape_all
+]
+
+
+def run_tests(label, render):
+    for i,test in enumerate(tests):
+        print("------{0} test {1}------".format(label, i+1))
+        # copy bindings as some tests have functions that modify the data
+        rendered = render(test["template"], copy.deepcopy(test["bindings"]), test["options"] if "options" in test else None)
+        print(test["expected"])
+        print(rendered)
+        if rendered.strip() != test["expected"].strip():
+            print("---{0} TEST {1} FAILED--".format(label.upper(), i+1))
+            exit(1)
+
+
+def render_compiled(template, bindings, options=None):
+    return Templatize.make(template, dict(options if options else {}, compile=True)).render(bindings, options)
+
+
+def render_streamed(template, bindings, options=None):
+    return "".join(Templatize.make(template, options).render_iter(bindings, options))
+
+
+def render_to_stream(template, bindings, options=None):
+    stream = io.BytesIO()
+    Templatize.make(template, options).render_to(bindings, stream, options, buffer_size=16)
+    return stream.getvalue().decode("utf-8")
+
+
+def render_batched(template, bindings, options=None):
+    interface = Templatize.make(template, options)
+    rendered = list(interface.render_many([bindings, copy.deepcopy(bindings)], options))
+    # compiled for the batch only, templates may be shared so are left as they were
+    if interface._template.program is not None:
+        return None
+    return rendered[0] if len(rendered) == 2 and rendered[0] == rendered[1] else None
+
+
+def render_scoped(template, bindings, options=None):
+    return Templatize.render(template, bindings, dict(options if options else {}, scoped_iterations=True))
+
+
+def render_single_pass(template, bindings, options=None):
+    return Templatize.make(template, dict(options if options else {}, engine="single_pass")).render(bindings, options)
+
+
+def render_fragments(template, bindings, options=None):
+    interface = Templatize.make(template, options)
+    dependencies = interface.dependencies()
+    # cached output assumes functions are pure, so skip tests counting calls
+    cache = FragmentCache(dependencies["sections"] if not dependencies["functions"] else [])
+    return interface.render(bindings, dict(options if options else {}, fragment_cache=cache))
+
+
+def render_mapped(template, bindings, options=None):
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".html", delete=False) as fp:
+        fp.write(template)
+    try:
+        rendered = [
+            Templatize.make_file(fp.name, dict(options if options else {}, engine=engine, map_size=0)).render(copy.deepcopy(bindings), options)
+            for engine in ("two_pass", "single_pass")
+        ]
+    finally:
+        os.remove(fp.name)
+    return rendered[0] if rendered[0] == rendered[1] else None
+
+
+def render_disk_cached(template, bindings, options=None):
+    with tempfile.TemporaryDirectory() as directory:
+        options = dict(options if options else {}, disk_cache=DiskTemplateCache(directory))
+        # first render parses and writes the entry, the second loads it
+        rendered = [Templatize.make(template, options).render(copy.deepcopy(bindings), options) for i in range(2)]
+        stats = options["disk_cache"].stats()
+    return rendered[0] if rendered[0] == rendered[1] and stats["hits"] >= 1 else None
+
+
+run_tests("Interpreted", Templatize.render)
+run_tests("Compiled", render_compiled)
+run_tests("Streamed", render_streamed)
+run_tests("Stream write", render_to_stream)
+run_tests("Batched", render_batched)
+run_tests("Scoped iterations", render_scoped)
+run_tests("Single-pass", render_single_pass)
+run_tests("Fragment cache", render_fragments)
+run_tests("Mapped file", render_mapped)
+run_tests("Disk cache", render_disk_cached)
+
+
+print("------Single-pass in-context within value------")
+# in-context search within a plain value finds nothing, regardless of what else was already rendered
+template = r"{{.hours}}|{{^closed}}{{.hours}}{{/closed}}"
+rendered = [Templatize.make(template, {"engine": engine}).render({'closed': False, 'hours': "9-5"}) for engine in ("two_pass", "single_pass")]
+print(rendered)
+# default engine re-tries in-context tags against the root data
+if rendered != ["9-5|9-5", "9-5|"]:
+    print("---SINGLE-PASS IN-CONTEXT WITHIN VALUE TEST FAILED--")
+    exit(1)
+
+
+print("------Template cache------")
+Templatize.clear_cache()
+Templatize.cache_size(2)
+for template in (r"{{a}}", r"{{b}}", r"{{a}}", r"{{c}}", r"{{b}}"):
+    Templatize.render(template, {'a': 1, 'b': 2, 'c': 3})
+stats = Templatize.cache_stats()
+print(stats)
+if (stats["hits"], stats["misses"], stats["evictions"], stats["count"]) != (1, 4, 2, 2):
+    print("---TEMPLATE CACHE TEST FAILED--")
+    exit(1)
+Templatize.clear_cache()
+Templatize.cache_size(128)
+
+
+print("------Partials cache------")
+# partial strings are parsed once per process, even though each Templatize.render() creates a new registry
+Partials.cache.clear()
+rendered = [
+    Templatize.render(r"{{>name}}!", {'name': "Bob"}, {"partials": {'name': r"<b>{{name}}</b>"}}) for i in range(3)
+]
+stats = Partials.cache.stats()
+print(rendered, stats)
+if rendered != ["<b>Bob</b>!"]*3 or (stats["misses"], stats["count"]) != (1, 1):
+    print("---PARTIALS CACHE TEST FAILED--")
+    exit(1)
+
+
+print("------Template dependencies------")
+dependencies = Templatize.make(
+    r"{{title}}{{#items}}{{.sku}} {{.price::$.2f}} {{currency}}{{/items}}{{^empty}}{{total->tax}}{{/empty}}{{>card}}", 
+    {"partials": {'card': r"{{#owner}}{{.name}}{{/owner}}"}}
+).dependencies()
+print(dependencies)
+if dependencies != {
+    'values':    ["currency", "items.price", "items.sku", "owner.name", "title", "total"], 
+    'sections':  ["empty", "items", "owner"], 
+    'repeating': ["items", "owner"], 
+    'functions': ["tax"], 
+    'partials':  ["card"]
+}:
+    print("---DEPENDENCIES TEST FAILED--")
+    exit(1)
+# partials given as strings are parsed with the template's delimiters
+dependencies = parse(r"<%title%><%>card%>", {"delimiters": ["<%", "%>"]}).dependencies({'card': r"<%#owner%><%.name%><%/owner%>"})
+print(dependencies)
+if (dependencies["values"], dependencies["sections"]) != (["owner.name", "title"], ["owner"]):
+    print("---DEPENDENCIES TEST FAILED--")
+    exit(1)
+
+
+print("------Fragment cache------")
+fragments = FragmentCache(["nav", "menu", "greeting"], keys={'menu': lambda root : root["menu_version"]})
+interface = Templatize.make(
+    r"{{#nav}}{{>link}}{{/nav}}{{#menu}}{{.}} {{/menu}}{{#user}}{{.name}}{{/user}}", 
+    {"fragment_cache": fragments, "partials": {'link': r"<a>{{.title}}</a>"}}
+)
+bindings = {
+    'nav': {'title': "Home"}, 'menu': lambda self, root : ["burger"], 'menu_version': 1, 
+    'user': {'name': "Bob"}
+}
+rendered = [interface.render(bindings)]
+# keyed sections are only rendered again when their key changes
+bindings['menu'] = lambda self, root : ["fries"]
+rendered.append(interface.render(bindings))
+bindings['menu_version'] = 2
+rendered.append(interface.render(bindings))
+bindings['nav']['title'] = "Burgers"
+rendered.append(interface.render(bindings))
+# partials are keyed by content, so overrides with other content are a miss, the same content a hit
+rendered.append(interface.render(bindings, {"partials": {'link': r"<b>{{.title}}</b>"}}))
+rendered.append(interface.render(bindings, {"partials": {'link': r"<a>{{.title}}</a>"}}))
+fragments.invalidate("menu")
+rendered.append(interface.render(bindings))
+stats = fragments.stats()
+print(rendered[-1], stats)
+if rendered != [
+    "<a>Home</a>burger Bob", 
+    "<a>Home</a>burger Bob", 
+    "<a>Home</a>fries Bob", 
+    "<a>Burgers</a>fries Bob", 
+    "<b>Burgers</b>fries Bob", 
+    "<a>Burgers</a>fries Bob", 
+    "<a>Burgers</a>fries Bob"
+] or (stats["hits"], stats["misses"], stats["invalidations"]) != (8, 6, 2):
+    print("---FRAGMENT CACHE TEST FAILED--")
+    exit(1)
+# sections depending on functions (without a key) are never cached, e.g. fresh closures per render, which once freed
+# may be reallocated at the same address
+def test_greeting(name):
+    return lambda self, root : "Hi " + name
+interface = Templatize.make(r"{{#greeting}}{{.}}{{/greeting}}", {"fragment_cache": fragments})
+names = ["Bob", "Linda", "Tina", "Gene", "Louise"]*4
+rendered = []
+for name in names:
+    rendered.append(interface.render({'greeting': test_greeting(name)}))
+    gc.collect()
+stats = fragments.stats()
+print(rendered[-1], stats)
+if rendered != ["Hi " + name for name in names] or stats["bypasses"] != len(names):
+    print("---FRAGMENT CACHE TEST FAILED--")
+    exit(1)
+# in-context tags missing from the section's data are re-tried against the root, so are part of its fingerprint
+interface = Templatize.make(r"{{#hours}}{{.open}}-{{.close}}{{/hours}}", {"fragment_cache": FragmentCache(["hours"])})
+bindings = {'open': "9", 'hours': {'close': "5"}}
+rendered = [interface.render(bindings)]
+bindings['open'] = "10"
+rendered.append(interface.render(bindings))
+print(rendered)
+if rendered != ["9-5", "10-5"]:
+    print("---FRAGMENT CACHE TEST FAILED--")
+    exit(1)
+
+
+print("------Function cache------")
+memoized_calls = []
+@memoize(".price", "currency")
+def test_price_label(self, root):
+    memoized_calls.append(self["price"])
+    return "{0}{1:.2f}".format(root["currency"], self["price"])
+functions = FunctionCache()
+interface = Templatize.make(r"{{#items}}{{.label}} {{/items}}", {"function_cache": functions})
+bindings = {'currency': "$", 'items': [{'price': price, 'label': test_price_label} for price in (5, 2, 5)]}
+rendered = [interface.render(bindings), interface.render(bindings)]
+bindings['currency'] = "£"
+rendered.append(interface.render(bindings))
+stats = functions.stats()
+print(rendered[-1], memoized_calls, stats)
+if rendered != ["$5.00 $2.00 $5.00 ", "$5.00 $2.00 $5.00 ", "£5.00 £2.00 £5.00 "] \
+        or memoized_calls != [5, 2, 5, 2] or (stats["hits"], stats["misses"]) != (5, 4):
+    print("---FUNCTION CACHE TEST FAILED--")
+    exit(1)
+# caches apply within partials too
+memoized_calls.clear()
+@memoize(".price")
+def test_price_cents(self, root):
+    memoized_calls.append(self["price"])
+    return "{0}00c".format(self["price"])
+interface = Templatize.make(
+    r"{{#special}}Today: {{>price}}{{/special}}", {"function_cache": FunctionCache(), "partials": {'price': r"{{.label}}"}}
+)
+bindings = {'special': {'price': 7, 'label': test_price_cents}}
+rendered = [interface.render(bindings), interface.render(bindings)]
+print(rendered[-1], memoized_calls)
+if rendered != ["Today: 700c"]*2 or memoized_calls != [7]:
+    print("---FUNCTION CACHE TEST FAILED--")
+    exit(1)
+
+
+print("------Lazy bindings------")
+loader_calls = []
+class TestCustomer(Loader):
+    def __init__(self, name):
+        self.name = name
+    @classmethod
+    def load_many(cls, loaders, paths):
+        loader_calls.append(("customers", len(loaders), paths))
+        return [{'name': loader.name} for loader in loaders]
+class TestOrder(Loader):
+    def __init__(self, index):
+        self.index = index
+    def load(self, paths):
+        loader_calls.append(("order", self.index, paths))
+        return {'id': self.index, 'customer': TestCustomer("Bob" if self.index % 2 else "Linda")}
+class TestAccount(Loader):
+    def load(self, paths):
+        loader_calls.append(("account", paths))
+        return {'title': "Orders", 'orders': [TestOrder(i) for i in range(3)], 'unused': TestOrder(9)}
+interface = Templatize.make(r"{{title}}: {{#orders}}{{.id}}-{{.customer.name}} {{/orders}}{{missing}}")
+rendered = interface.render(TestAccount())
+print(rendered, loader_calls)
+if rendered != "Orders: 0-Linda 1-Bob 2-Linda " or loader_calls != [
+    ("account", ["missing", "orders", "orders._display", "orders.customer.name", "orders.id", "title"]), 
+    ("order", 0, ["_display", "customer.name", "id"]), 
+    ("order", 1, ["_display", "customer.name", "id"]), 
+    ("order", 2, ["_display", "customer.name", "id"]), 
+    ("customers", 3, ["name"])
+]:
+    print("---LAZY BINDINGS TEST FAILED--")
+    exit(1)
+
+
+print("------Profiler------")
+template = r"<h1>{{title}}</h1>{{#items}}<li>{{.name}} {{.label}}</li>{{/items}}{{>footer}}"
+bindings = {'title': "Menu", 'items': [{'name': "Burger", 'label': lambda self, root : "new"}, {'name': "Fries"}]}
+for engine in ("two_pass", "single_pass"):
+    profiler = Profiler()
+    interface = Templatize.make(template, {"partials": {"footer": r"<p>{{title}}</p>"}, "engine": engine})
+    rendered = [interface.render(bindings, {"profiler": profiler}), interface.render(bindings, {"profiler": profiler})]
+    report = profiler.report()
+    print(report)
+    profiled = dict(
+        ((entry["partial"], entry["name"], entry["position"]), (entry["calls"], entry["bytes"])) for entry in report.tags
+    )
+    if rendered != [interface.render(bindings)]*2 or report.renders != 2 or profiled != {
+        (None, "{{title}}", 0): (2, 8), (None, "{{#items}}", 1): (2, 68), (None, "{{.name}}", 2): (4, 22), 
+        (None, "{{.label}}", 3): (2, 6), (None, "{{>footer}}", 4): (2, 22), ("footer", "{{title}}", 0): (2, 8)
+    } or [(entry["name"], entry["calls"]) for entry in report.functions] != [("items.label", 2)] \
+            or [(entry["name"], entry["calls"]) for entry in report.partials] != [("footer", 2)]:
+        print("---PROFILER TEST FAILED--")
+        exit(1)
+
+
+print("------Template from file------")
+import pickle
+from lib.interface import Interface
+from lib.template import Template
+from lib.nodes import MappedTextNode
+files = []
+for source in (r"<p>Crème brûlée — !{{price}} {{price::$.2f}}</p>{{#items}}<i>{{.}}</i>{{/items}}ünï", "", r"<<name>> ≠ {{name}}"):
+    with tempfile.NamedTemporaryFile("wb", suffix=".html", delete=False) as fp:
+        fp.write(source.encode("utf-8"))
+    files.append(fp.name)
+bindings = {'price': 5, 'items': ["a", "b"], 'name': "Bob"}
+# small files are read, others mapped
+mapped = Template.from_file(files[0], {"map_size": 0})
+rendered = [
+    Templatize.make_file(files[0]).render(bindings), 
+    "".join(Templatize.make_file(files[0], {"engine": "single_pass", "map_size": 0}).render_iter(bindings)), 
+    Templatize.make_file(files[1], {"map_size": 0}).render(bindings), 
+    Templatize.make_file(files[2], {"delimiters": ["<<", ">>"], "map_size": 0}).render(bindings), 
+    # mappings can't be pickled (e.g. to worker processes), so text is sent as plain text
+    Interface(pickle.loads(pickle.dumps(mapped))).render(bindings)
+]
+print(rendered)
+spans = [node.spans for node in mapped.root.inner if isinstance(node, MappedTextNode)]
+copied = [node for node in Template.from_file(files[0]).root.inner if isinstance(node, MappedTextNode)]
+del mapped
+for path in files:
+    os.remove(path)
+if rendered != [
+    "<p>Crème brûlée — {{price}} $5.00</p><i>a</i><i>b</i>ünï", 
+    "<p>Crème brûlée — {{price}} $5.00</p><i>a</i><i>b</i>ünï", 
+    "", 
+    "Bob ≠ {{name}}", 
+    "<p>Crème brûlée — {{price}} $5.00</p><i>a</i><i>b</i>ünï"
+] or spans != [((0, 23), (24, 34)), ((49, 53),), ((85, 90),)] or copied:
+    print("---TEMPLATE FROM FILE TEST FAILED--")
+    exit(1)
+
+
+print("------Disk template cache------")
+with tempfile.TemporaryDirectory() as directory:
+    disk_cache = DiskTemplateCache(directory)
+    options = {"disk_cache": disk_cache, "partials": {"header": r"<h1>{{title}}</h1>"}}
+    template = r"{{>header}}<ul>{{#items}}<li>{{.}}</li>{{/items}}</ul>"
+    bindings = {'title': "Kids", 'items': ["Gene", "Louise"]}
+    rendered = [Templatize.make(template, options).render(bindings)]
+    counts = [disk_cache.stats()]
+    # partials parsed in this process are kept in memory, so cleared as if loading in a new process
+    Partials.cache.clear()
+    rendered.append(Templatize.make(template, options).render(bindings))
+    counts.append(disk_cache.stats())
+    # stale entries (e.g. corrupted, or from another version) are detected and rebuilt, partials included
+    for path in os.listdir(directory):
+        with open(os.path.join(directory, path), "r+b") as fp:
+            fp.write(b"stale")
+    Partials.cache.clear()
+    rendered.append(Templatize.render(template, bindings, options))
+    counts.append(disk_cache.stats())
+    rendered.append(Templatize.make(template, dict(options, delimiters=["<%", "%>"])).render(bindings))
+    counts.append(disk_cache.stats())
+    print(rendered, counts)
+    if rendered != ["<h1>Kids</h1><ul><li>Gene</li><li>Louise</li></ul>"]*3 + [template] or counts != [
+        {"count": 2, "hits": 0, "misses": 2, "rebuilds": 0}, 
+        {"count": 2, "hits": 2, "misses": 2, "rebuilds": 0}, 
+        {"count": 2, "hits": 2, "misses": 2, "rebuilds": 2}, 
+        {"count": 4, "hits": 2, "misses": 4, "rebuilds": 2}
+    ]:
+        print("---DISK TEMPLATE CACHE TEST FAILED--")
+        exit(1)
+    # templates are still made if entries can't be serialized or written
+    dumps = Template.dumps
+    Template.dumps = lambda self : 1/0
+    try:
+        rendered = Templatize.make(r"<p>{{title}}</p>", options).render(bindings)
+    finally:
+        Template.dumps = dumps
+    if rendered != "<p>Kids</p>" or disk_cache.stats()["count"] != 4:
+        print("---DISK TEMPLATE CACHE TEST FAILED--")
+        exit(1)
+
+
+print("------Render session------")
+interface = Templatize.make(
+    r"<h1>{{title}}</h1><p>{{cpu.load::.0%}}</p>{{#disks}}<li>{{.name}}</li>{{/disks}}<p>{{uptime}}</p>"
+)
+bindings = {'title': "Servers", 'cpu': {'load': 0.5}, 'disks': [{'name': "sda"}], 'uptime': lambda self, root : "1h"}
+session = interface.session(bindings)
+bindings['cpu']['load'] = 0.75
+updates = [session.update(changed=["cpu.load"])]
+updates.append(session.update(dict(bindings, disks=[{'name': "sda"}, {'name': "sdb"}])))
+updates.append(session.update())
+print(updates)
+if updates != [
+    ("<h1>Servers</h1><p>75%</p><li>sda</li><p>1h</p>", [(19, 22)]), 
+    ("<h1>Servers</h1><p>75%</p><li>sda</li><li>sdb</li><p>1h</p>", [(26, 50)]), 
+    ("<h1>Servers</h1><p>75%</p><li>sda</li><li>sdb</li><p>1h</p>", [])
+]:
+    print("---RENDER SESSION TEST FAILED--")
+    exit(1)
+# functions anywhere within, e.g. in list items, can't be tracked, so parts depending on them always render again
+disk_reads = []
+def test_disk_name(self, root):
+    disk_reads.append(1)
+    return "sd{0}".format(len(disk_reads))
+session = Templatize.make(r"<ul>{{#disks}}<li>{{.name}}</li>{{/disks}}</ul>").session({'disks': [{'name': test_disk_name}]})
+updates = [session.update(), session.update()]
+print(updates)
+if updates != [("<ul><li>sd2</li></ul>", [(4, 16)]), ("<ul><li>sd3</li></ul>", [(4, 16)])]:
+    print("---RENDER SESSION TEST FAILED--")
+    exit(1)
+# in-context tags missing from the section's data are re-tried against the root, so parts depend on that as well
+bindings = {'online': True, 'cpu': {'load': 0.5}}
+session = Templatize.make(r"{{#cpu}}{{.load}} {{.online}}{{/cpu}}").session(bindings)
+bindings = dict(bindings, online=1)
+updates = [session.update(bindings)]
+bindings['online'] = False
+updates.append(session.update(changed=["online"]))
+print(updates)
+if updates != [("0.5 1", [(0, 5)]), ("0.5 False", [(0, 9)])]:
+    print("---RENDER SESSION TEST FAILED--")
+    exit(1)
+
+
+print("------Concurrent rendering------")
+# one shared interface, with per-render options and data differing between threads
+interface = Templatize.make(test_sections_2["template"])
+jobs = [
+    ({'monday': i % 3, 'sunday': 0, 'saturday': i}, {"eval_zero_as_true": bool(i % 2)})
+    for i in range(2000)
+]
+expected = [interface.render(bindings, options) for bindings, options in jobs]
+switch_interval = sys.getswitchinterval()
+sys.setswitchinterval(1e-6)
+with ThreadPoolExecutor(16) as pool:
+    rendered = list(pool.map(lambda job : interface.render(job[0], job[1]), jobs))
+sys.setswitchinterval(switch_interval)
+print(rendered[-1])
+if rendered != expected:
+    print("---CONCURRENT TEST FAILED--")
+    exit(1)
+
+
+print("------Async rendering------")
+in_flight = {'now': 0, 'max': 0}
+async def test_async_fetch(value):
+    in_flight['now'] += 1
+    in_flight['max'] = max(in_flight['max'], in_flight['now'])
+    await asyncio.sleep(0.01)
+    in_flight['now'] -= 1
+    return value
+async def test_async_name(self, root):
+    return await test_async_fetch({'first': "Bob"})
+test_async = {
+    "template": r"{{name.first}} sells {{&menu}} for {{price::$.2f}} each.", 
+    "bindings": {
+      'name': test_async_name, 
+      'menu': lambda self, root : ["burgers", "fries"], 
+      'price': test_async_fetch(5)
+    }, 
+    "expected": r"Bob sells burgers and fries for $5.00 each."
+}
+rendered = asyncio.run(Templatize.make(test_async["template"]).render_async(test_async["bindings"]))
+print(rendered)
+if rendered != test_async["expected"] or in_flight['max'] != 2:
+    print("---ASYNC TEST FAILED--")
+    exit(1)
+# only bindings the template refers to are scanned and awaited, so cycles elsewhere in bindings are fine
+async_calls = []
+async def test_async_unused(self, root):
+    async_calls.append("unused")
+    return "unused"
+async def test_async_failing(self, root):
+    async_calls.append("failing")
+    raise Exception("unavailable")
+bindings = {'name': test_async_name, 'unused': test_async_unused, 'status': test_async_failing}
+bindings['self'] = bindings
+interface = Templatize.make(r"{{name.first}} is {{status}}.")
+rendered = [asyncio.run(interface.render_async(bindings))]
+# failures are handled as any failed function binding
+try:
+    asyncio.run(interface.render_async(bindings, {"error_on_func_failure": True}))
+    rendered.append(None)
+except Exception as e:
+    rendered.append(str(e))
+print(rendered, async_calls)
+if rendered != ["Bob is .", "unavailable"] or async_calls != ["failing", "failing"]:
+    print("---ASYNC TEST FAILED--")
+    exit(1)
+
+
+# guarded as worker processes may re-import this module
+if __name__ == "__main__":
+    print("------Parallel rendering------")
+    interface = Templatize.make(test_sections_5["template"], {"partials": {'unused': r"{{.}}"}})
+    bindings_list = [copy.deepcopy(test_sections_5["bindings"]) for i in range(50)]
+    bindings_list[25]['name']['last'] = "Pesto"
+    expected = [interface.render(bindings) for bindings in bindings_list]
+    rendered = list(interface.render_many(bindings_list, workers=2, batch_size=7))
+    print(rendered[25])
+    if rendered != expected:
+        print("---PARALLEL TEST FAILED--")
+        exit(1)